@@ -1,18 +1,34 @@
 import sys
 
-from functools import total_ordering
-
-@total_ordering
 class FrameCount(object):
-  def __init__(self, count):
-    self.count = count
+  """
+  An immutable number of frames.  Instances for small whole numbers of
+  frames are shared, so the common values do not need to be allocated.
+  """
+
+  __slots__ = ( 'count', )
+
+  def __new__(cls, count):
+    if type(count) is int and 0 <= count < _NUM_SHARED:
+      shared = _shared[count]
+      if shared is not None:
+        return shared
+    self = object.__new__(cls)
+    object.__setattr__(self, 'count', count)
+    return self
+
+  def __setattr__(self, name, value):
+    raise AttributeError('FrameCount is immutable')
+
+  def __reduce__(self):
+    return (FrameCount, (self.count,))
 
   def to_seconds(self):
     return self.count / 60.0
 
   @classmethod
   def from_seconds(cls, secs):
-    return cls(round(secs * 60, 0))
+    return cls(round(secs * 60))
 
   @classmethod
   def parse(cls, s):
@@ -20,11 +36,28 @@ class FrameCount(object):
     return cls(int(secs)*60 + int(frames))
 
   def __eq__(self, other):
+    if not isinstance(other, FrameCount): return NotImplemented
     return self.count == other.count
 
+  def __ne__(self, other):
+    if not isinstance(other, FrameCount): return NotImplemented
+    return self.count != other.count
+
+  def __lt__(self, other):
+    return self.count < other.count
+
   def __le__(self, other):
     return self.count <= other.count
 
+  def __gt__(self, other):
+    return self.count > other.count
+
+  def __ge__(self, other):
+    return self.count >= other.count
+
+  def __hash__(self):
+    return hash(self.count)
+
   def __add__(self, other):
     return FrameCount(self.count + other.count)
 
@@ -39,4 +72,11 @@ class FrameCount(object):
     else:
       return '%s%d:%02d\'%02d' % (sign, count / 60 / 60, (count / 60) % 60, abs(count) % 60)
 
+# Enough to cover most room and door times (a little over a minute)
+_NUM_SHARED = 4096
+_shared = [ None ] * _NUM_SHARED
+for _count in range(_NUM_SHARED):
+  _shared[_count] = FrameCount(_count)
+del _count
+
 FrameCount.max = FrameCount(sys.maxsize)
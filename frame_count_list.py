@@ -1,29 +1,251 @@
 from frame_count import FrameCount
+from quantile_sketch import KLLSketch
 
 from scipy import stats
 
+from array import array
+from typing import NamedTuple
+
 import statistics
 
-class FrameCountList(object):
+def score_at_percentile(sorted_values, p):
+  # Same as scipy's stats.scoreatpercentile, for values that are
+  # already sorted
+  idx = p / 100.0 * (len(sorted_values) - 1)
+  i = int(idx)
+  if i == idx:
+    return sorted_values[i]
+  lower_weight = (i + 1) - idx
+  upper_weight = idx - i
+  return (sorted_values[i] * lower_weight + sorted_values[i + 1] *
+      upper_weight) / (lower_weight + upper_weight)
+
+class FrameCountSummary(NamedTuple):
+  n: int
+  best: FrameCount
+  prev_best: FrameCount
+  mean: FrameCount
+  p25: FrameCount
+  p50: FrameCount
+  p75: FrameCount
+  p90: FrameCount
+
+class FrameCountHistogram(object):
+  """
+  Dense histogram of frame counts, indexed by frame count relative to
+  the smallest value seen.  Room times fall in a narrow range of frames,
+  so order statistics can be computed by walking the counts instead of
+  sorting the values.  Frame counts read from a log are not always
+  whole numbers, so values are rounded to the nearest frame.
+  """
+
   def __init__(self):
-    self._list = [ ]
-    self._values = [ ]
+    self.lo = 0
+    self.counts = array('l')
+    self.n = 0
+
+  def add(self, count):
+    count = round(count)
+    if self.n == 0 and len(self.counts) == 0:
+      self.lo = count
+    if count < self.lo:
+      self.counts[0:0] = array('l', [ 0 ]) * (self.lo - count)
+      self.lo = count
+    idx = count - self.lo
+    if idx >= len(self.counts):
+      self.counts.extend(array('l', [ 0 ]) * (idx + 1 - len(self.counts)))
+    self.counts[idx] += 1
+    self.n += 1
+
+  def remove(self, count):
+    count = round(count)
+    self.counts[count - self.lo] -= 1
+    self.n -= 1
+
+  def min(self):
+    for idx, c in enumerate(self.counts):
+      if c > 0: return self.lo + idx
+
+  def max(self):
+    for idx in range(len(self.counts) - 1, -1, -1):
+      if self.counts[idx] > 0: return self.lo + idx
+
+  def value_at(self, rank):
+    # Value of the rank-th smallest value (counting from 0)
+    seen = 0
+    for idx, c in enumerate(self.counts):
+      seen += c
+      if seen > rank: return self.lo + idx
+
+  def percentile(self, p):
+    # Same interpolation as scipy.stats.scoreatpercentile
+    idx = p / 100.0 * (self.n - 1)
+    i = int(idx)
+    frac = idx - i
+    lower = self.value_at(i)
+    if frac == 0:
+      return lower
+    return lower + (self.value_at(i + 1) - lower) * frac
+
+  def median(self):
+    if self.n % 2 == 1:
+      return self.value_at(self.n // 2)
+    return (self.value_at(self.n // 2 - 1) + self.value_at(self.n // 2)) / 2
+
+  def as_percentiles(self):
+    # Percentage of values strictly less than each value
+    p = { }
+    below = 0
+    for idx, c in enumerate(self.counts):
+      if c > 0:
+        p[self.lo + idx] = 100.0 * below / (self.n - 1)
+        below += c
+    return p
+
+  def as_dict(self):
+    return { 'lo': self.lo, 'counts': list(self.counts) }
+
+class FrameCountTable(object):
+  """
+  Frame counts for a number of series, packed into a single array with
+  one row per attempt and one column per series.  Frame counts are whole
+  numbers, so they are stored as integers; missing values are stored as
+  MISSING.
+  """
+
+  # Smaller than any frame count, and fits in a C long on every platform
+  MISSING = -2**31
+
+  def __init__(self, ncols):
+    self.ncols = ncols
+    self._data = array('l')
+    self._start = 0
+
+  def append(self, row):
+    self._data.extend(row)
+
+  def popleft(self):
+    n = self.ncols
+    row = self._data[self._start:self._start + n]
+    self._start += n
+
+    # Reclaim the space for discarded rows once they make up half the
+    # array
+    if self._start * 2 >= len(self._data):
+      del self._data[:self._start]
+      self._start = 0
+
+    return row
+
+  def column(self, col):
+    return self._data[self._start + col::self.ncols]
+
+  def last(self, col):
+    return self._data[len(self._data) - self.ncols + col]
+
+  def __len__(self):
+    return (len(self._data) - self._start) // self.ncols
+
+class FrameCountList(object):
+  """
+  A view of one column of a FrameCountTable, with summary statistics.
+  The table is owned by the caller, which appends each row before
+  recording its values in the views.
+
+  If sketch_k is given, the median and percentiles are approximated
+  with a KLLSketch of that size (with rank error given by
+  sketch().normalized_rank_error()), so they can be computed without
+  sorting every value.  If histogram is true, they are computed exactly
+  from a FrameCountHistogram instead.  If ewma_alpha is given, an
+  exponentially weighted moving average is kept as well.
+  """
+
+  def __init__(self, table, column, sketch_k=None, histogram=False, ewma_alpha=None):
+    self._table = table
+    self._column = column
+    self._missing = 0
     self._best = FrameCount.max
     self._prev_best = FrameCount.max
+    self._sketch = KLLSketch(sketch_k) if sketch_k is not None else None
+    self._histogram = FrameCountHistogram() if histogram else None
+    self._ewma_alpha = ewma_alpha
+    self._ewma = None
+    self._summary = None
 
-  def append(self, frame_count):
-    if frame_count is not None and frame_count <= self._best:
+  def record(self, frame_count):
+    self._summary = None
+
+    if frame_count is None:
+      self._missing += 1
+      return
+
+    if frame_count <= self._best:
       self._prev_best = self._best
       self._best = frame_count
-    self._list.append(frame_count.count if frame_count is not None else None)
-    if frame_count is not None: self._values.append(frame_count.count)
+    if self._sketch is not None:
+      self._sketch.update(frame_count.count)
+    if self._histogram is not None:
+      self._histogram.add(frame_count.count)
+    if self._ewma_alpha is not None:
+      if self._ewma is None:
+        self._ewma = frame_count.count
+      else:
+        self._ewma += self._ewma_alpha * (frame_count.count - self._ewma)
+
+  def discard(self, count):
+    # The best and previous best (and the sketch, which cannot forget
+    # values) are kept even if they have been discarded from the table
+    self._summary = None
+    if count == FrameCountTable.MISSING:
+      self._missing -= 1
+    elif self._histogram is not None:
+      self._histogram.remove(count)
+
+  def summarize(self):
+    """
+    Returns a FrameCountSummary, computed with a single sort of the
+    values and cached until the next value is recorded or discarded.
+    """
+    if self._summary is not None:
+      return self._summary
+
+    values = self.values()
+    n = len(values)
+    if n == 0:
+      self._summary = FrameCountSummary(n=0, best=self._best,
+          prev_best=self._prev_best, mean=None, p25=None, p50=None,
+          p75=None, p90=None)
+      return self._summary
+
+    mean = FrameCount(statistics.mean(values))
+
+    if self._histogram is not None or self._sketch is not None:
+      percentile = self.percentile
+      median = self.median()
+    else:
+      s = sorted(values)
+      percentile = lambda p: FrameCount(score_at_percentile(s, p))
+      mid = n // 2
+      median = FrameCount(s[mid] if n % 2 == 1 else (s[mid - 1] + s[mid]) / 2)
+
+    self._summary = FrameCountSummary(n=n, best=self._best,
+        prev_best=self._prev_best, mean=mean, p25=percentile(25),
+        p50=median, p75=percentile(75), p90=percentile(90))
+    return self._summary
 
   def mean(self):
     return FrameCount(statistics.mean(self.values()))
 
   def median(self):
+    if self._histogram is not None:
+      return FrameCount(self._histogram.median())
+    if self._sketch is not None:
+      return FrameCount(self._sketch.quantile(0.5))
     return FrameCount(statistics.median(self.values()))
 
+  def ewma(self):
+    return FrameCount(self._ewma) if self._ewma is not None else None
+
   def best(self):
     return self._best
 
@@ -31,25 +253,43 @@ class FrameCountList(object):
     return self._prev_best
 
   def most_recent(self):
-    return FrameCount(self.values()[-1])
+    count = self._table.last(self._column)
+    if count == FrameCountTable.MISSING:
+      count = self.values()[-1]
+    return FrameCount(count)
 
   def percentile(self, p):
+    if self._histogram is not None:
+      return FrameCount(self._histogram.percentile(p))
+    if self._sketch is not None:
+      return FrameCount(self._sketch.quantile(p / 100.0))
     return FrameCount(stats.scoreatpercentile(self.values(), p))
 
   def as_percentiles(self):
+    if self._histogram is not None:
+      return self._histogram.as_percentiles()
     l = self.values()
     d = { val: len(l) - idx - 1 for idx, val in enumerate(reversed(sorted(l))) }
     p = { x: 100.0 * d[x] / (len(l) - 1) for x in sorted(l) }
     return p
 
   def values(self):
-    return self._values
+    values = self._table.column(self._column)
+    if self._missing > 0:
+      values = array('l', (v for v in values if v != FrameCountTable.MISSING))
+    return values
+
+  def sketch(self):
+    return self._sketch
+
+  def histogram(self):
+    return self._histogram
 
   def __repr__(self):
-    mean = self.mean() if len(self.values()) > 0 else "NaN"
-    median = self.median() if len(self.values()) > 0 else "NaN"
-    best = self.best() if len(self.values()) > 0 else "NaN"
+    mean = self.mean() if len(self) > 0 else "NaN"
+    median = self.median() if len(self) > 0 else "NaN"
+    best = self.best() if len(self) > 0 else "NaN"
     return 'avg %s, median %s, best %s' % (mean, median, best)
 
   def __len__(self):
-    return len(self._values)
+    return len(self._table) - self._missing
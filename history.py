@@ -1,29 +1,131 @@
 from transition import Transition
-from frame_count_list import FrameCountList
+from frame_count_list import FrameCountList, FrameCountTable
+
+from array import array
+from collections import deque
+
+class RetentionPolicy(object):
+  """
+  Limits how many attempts per transition are kept in memory, either by
+  count or by age (in microseconds, relative to the newest attempt).
+  """
+
+  def __init__(self, max_attempts=None, max_age_us=None):
+    self.max_attempts = max_attempts
+    self.max_age_us = max_age_us
+
+  def expired(self, attempts):
+    if len(attempts) <= 1:
+      return False
+    if self.max_attempts is not None and len(attempts) > self.max_attempts:
+      return True
+    if self.max_age_us is not None:
+      return attempts.attempts[0].ts_us < attempts.attempts[-1].ts_us - self.max_age_us
+    return False
+
+def retention_policy(max_attempts=None, max_days=None):
+  if max_attempts is None and max_days is None:
+    return None
+  max_age_us = int(max_days * 86400 * 1000000) if max_days is not None else None
+  return RetentionPolicy(max_attempts, max_age_us)
+
+class TransitionWindow(object):
+  """
+  Stand-in for the list of all transitions when a retention policy is
+  in use.  Indexes are never reused, and looking up an index that has
+  been discarded returns None.
+  """
+
+  def __init__(self):
+    self._transitions = { }
+    self._count = 0
+
+  def append(self, transition):
+    self._transitions[self._count] = transition
+    self._count += 1
+
+  def discard(self, idx):
+    del self._transitions[idx]
+
+  def __getitem__(self, idx):
+    if idx < 0: idx += self._count
+    return self._transitions.get(idx)
+
+  def __len__(self):
+    return self._count
+
+  def __iter__(self):
+    return iter(self._transitions.values())
 
 class Attempts(object):
-  def __init__(self, transitions=None):
+  """
+  All the attempts for a transition.  The times are stored in a single
+  FrameCountTable, and each series (gametimes, realtimes, etc.) is a
+  FrameCountList view of one of its columns.
+
+  If recent_window (a RetentionPolicy) is given, the most recent
+  attempts are also kept in a second Attempts, which is returned by
+  recent().
+  """
+
+  columns = ( 'gametimes', 'realtimes', 'roomlagtimes', 'doorlagtimes',
+      'doorrealtimes', 'totalrealtimes' )
+
+  def __init__(self, transitions=None, sketch_k=None, histogram=False,
+      recent_window=None, ewma_alpha=None):
     transitions = transitions or [ ]
 
-    self.attempts = [ ]
-    self.gametimes = FrameCountList()
-    self.realtimes = FrameCountList()
-    self.roomlagtimes = FrameCountList()
-    self.doorlagtimes = FrameCountList()
-    self.doorrealtimes = FrameCountList()
-    self.totalrealtimes = FrameCountList()
+    self.attempts = deque()
+    self.total_count = 0
+    self.table = FrameCountTable(len(self.columns))
+    self.series = [ FrameCountList(self.table, col, sketch_k, histogram, ewma_alpha)
+        for col in range(len(self.columns)) ]
+    for name, series in zip(self.columns, self.series):
+      setattr(self, name, series)
+
+    self.recent_window = recent_window
+    self._recent = Attempts(histogram=histogram) if recent_window is not None else None
 
     for transition in transitions:
       self.append(transition)
 
   def append(self, transition):
     self.attempts.append(transition)
-    self.gametimes.append(transition.time.gametime)
-    self.realtimes.append(transition.time.realtime)
-    self.roomlagtimes.append(transition.time.roomlag)
-    self.doorlagtimes.append(transition.time.doorlag)
-    self.doorrealtimes.append(transition.time.realtime_door)
-    self.totalrealtimes.append(transition.time.totalrealtime)
+    self.total_count += 1
+
+    time = transition.time
+    row = ( time.gametime, time.realtime, time.roomlag, time.doorlag,
+        time.realtime_door, time.totalrealtime )
+    self.table.append([ t.count if t is not None else FrameCountTable.MISSING
+        for t in row ])
+    for series, t in zip(self.series, row):
+      series.record(t)
+
+    if self._recent is not None:
+      self._recent.append(transition)
+      while self.recent_window.expired(self._recent):
+        self._recent.popleft()
+
+  def recent(self):
+    return self._recent
+
+  def popleft(self):
+    row = self.table.popleft()
+    for series, count in zip(self.series, row):
+      series.discard(count)
+    return self.attempts.popleft()
+
+  def summarize(self):
+    return { name: series.summarize() for name, series in zip(self.columns, self.series) }
+
+  def column_sum(self, *names):
+    """
+    Element-wise sum of the given columns (e.g. realtimes and
+    doorlagtimes), skipping attempts where any of them is missing.
+    """
+    cols = [ self.table.column(self.columns.index(name)) for name in names ]
+    return array('l', (sum(counts) for counts in zip(*cols)
+        if FrameCountTable.MISSING not in counts))
 
   def __iter__(self):
     return iter(self.attempts)
@@ -35,35 +137,72 @@ class Attempts(object):
     return 'Attempts(%s)' % self.attempts
 
 class History(object):
-  def __init__(self, history=None, reset_rooms=None, completed_rooms=None):
+  def __init__(self, history=None, reset_rooms=None, completed_rooms=None,
+      retention=None, sketch_k=None, histogram=False, recent_window=None,
+      ewma_alpha=None):
     self.history = history or { }
-    self.all_transitions = [ ]
+    self.retention = retention
+    self.sketch_k = sketch_k
+    self.histogram = histogram
+    self.recent_window = recent_window
+    self.ewma_alpha = ewma_alpha
+    self.all_transitions = TransitionWindow() if retention is not None else [ ]
     self.indexes_by_tid = { }
     self.reset_rooms = reset_rooms or { }
     self.completed_rooms = completed_rooms or { }
+    self.subscribers = [ ]
+    self.expiry_subscribers = [ ]
+
+  def subscribe(self, callback):
+    """
+    Calls callback(transition) for each transition recorded from now on,
+    before the retention policy can discard it.
+    """
+    self.subscribers.append(callback)
+
+  def subscribe_expired(self, callback):
+    """
+    Calls callback(transition) for each transition the retention policy
+    discards from now on, after it has been removed from the history.
+    """
+    self.expiry_subscribers.append(callback)
 
   def record(self, transition, from_file=False):
     attempts = self.history.get(transition.id, None)
     if attempts is None:
-      attempts = Attempts()
+      attempts = self.new_attempts()
       self.history[transition.id] = attempts
 
     attempts.append(transition)
 
     indexes = self.indexes_by_tid.get(transition.id, None)
     if indexes is None:
-      indexes = [ ]
+      indexes = deque()
       self.indexes_by_tid[transition.id] = indexes
     indexes.append(len(self.all_transitions))
 
     self.all_transitions.append(transition)
 
+    for callback in self.subscribers:
+      callback(transition)
+
+    if self.retention is not None:
+      while self.retention.expired(attempts):
+        expired = attempts.popleft()
+        self.all_transitions.discard(indexes.popleft())
+        for callback in self.expiry_subscribers:
+          callback(expired)
+
     if not from_file:
       completed_rooms = self.completed_rooms.get(transition.id, 0) + 1
       self.completed_rooms[transition.id] = completed_rooms
 
     return attempts
 
+  def new_attempts(self, cls=Attempts):
+    return cls(sketch_k=self.sketch_k, histogram=self.histogram,
+        recent_window=self.recent_window, ewma_alpha=self.ewma_alpha)
+
   def record_reset(self, transition_id):
     # TODO: Store an object instead of a raw counter to make it more
     # like Attempts?
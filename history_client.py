@@ -0,0 +1,195 @@
+from frame_count import FrameCount
+from transition import Transition, TransitionId, TransitionTime
+from rooms import NullRoom
+from doors import NullDoor
+from history import History
+from stats import TransitionStats
+
+from typing import NamedTuple
+import json
+import os
+import socket
+import tempfile
+
+# Clients and the server exchange one JSON message per line.  Requests
+# are [ type, payload ] (the same shape as the practice timer's websocket
+# messages) and each request gets exactly one response, except for
+# 'follow', which streams a message for every transition appended after
+# the request.
+
+def default_socket_path():
+  return os.path.join(tempfile.gettempdir(), 'sm_room_timer.sock')
+
+def encode_frame_count(frame_count):
+  return frame_count.count if frame_count is not None else None
+
+def decode_frame_count(count):
+  return FrameCount(count) if count is not None else None
+
+def transition_to_row(transition):
+  return dict(zip(Transition.csv_headers(),
+    [ str(v) if v is not None else '' for v in transition.as_csv_row() ]))
+
+# Transitions sent in bulk (e.g. to build a history) are already decoded:
+# integer timestamps and frame counts instead of the csv's text and
+# seconds, and the ids of the room and doors instead of their names.
+
+def encode_transition(transition):
+  tid = transition.id
+  time = transition.time
+  return [
+    transition.ts_us, tid.room.room_id, tid.entry_door.door_id,
+    tid.exit_door.door_id, tid.items, tid.beams,
+    time.gametime.count, time.realtime.count,
+    encode_frame_count(time.roomlag), time.doorlag.count,
+    time.realtime_door.count, time.doortime_is_real,
+  ]
+
+class TransitionDecoder(object):
+  def __init__(self, rooms, doors):
+    self.rooms = rooms
+    self.doors = doors
+    self.tids = { }
+
+  def _room(self, room_id):
+    return self.rooms.from_id(room_id) if room_id != 0 else NullRoom
+
+  def _door(self, door_id):
+    return self.doors.from_id(door_id) if door_id != 0 else NullDoor
+
+  def decode(self, row):
+    (ts_us, room_id, entry_door_id, exit_door_id, items, beams,
+        gametime, realtime, roomlag, doorlag, realtime_door,
+        doortime_is_real) = row
+
+    key = (room_id, entry_door_id, exit_door_id, items, beams)
+    tid = self.tids.get(key)
+    if tid is None:
+      tid = TransitionId(
+          room=self._room(room_id),
+          entry_door=self._door(entry_door_id),
+          exit_door=self._door(exit_door_id),
+          items=items,
+          beams=beams)
+      self.tids[key] = tid
+
+    time = TransitionTime(
+        gametime=FrameCount(gametime),
+        realtime=FrameCount(realtime),
+        roomlag=decode_frame_count(roomlag),
+        doorlag=FrameCount(doorlag),
+        realtime_door=FrameCount(realtime_door),
+        doortime_is_real=doortime_is_real)
+
+    return Transition(ts_us, tid, time)
+
+class RemoteSegment(NamedTuple):
+  id: str
+  name: str
+  brief_name: str
+
+  def __str__(self):
+    return self.name
+
+class RemoteSingleSegmentStats(NamedTuple):
+  segment: RemoteSegment
+  segment_success_count: int
+  rate: float
+  p50: FrameCount
+  p0: FrameCount
+  sob: FrameCount
+
+class RemoteSegmentStats(NamedTuple):
+  segments: list
+  total_p50: FrameCount
+  total_p0: FrameCount
+  total_sob: FrameCount
+
+class HistoryClient(object):
+  """
+  Connection to a history server.  Can be used in place of a
+  FileTransitionLog, in which case transitions are appended by the
+  server.
+  """
+
+  def __init__(self, socket_path=None):
+    self.socket_path = socket_path or default_socket_path()
+    self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    self.sock.connect(self.socket_path)
+    self.file = self.sock.makefile('rwb')
+
+  def close(self):
+    self.file.close()
+    self.sock.close()
+
+  def send(self, msg_type, payload):
+    self.file.write(json.dumps([ msg_type, payload ]).encode() + b'\n')
+    self.file.flush()
+
+  def receive(self):
+    line = self.file.readline()
+    if not line:
+      raise ConnectionError('History server closed the connection')
+    return json.loads(line)
+
+  def request(self, msg_type, payload=None):
+    self.send(msg_type, payload or { })
+    status, result = self.receive()
+    if status != 'ok':
+      raise RuntimeError('History server error: %s' % result)
+    return result
+
+  def write_transition(self, transition):
+    self.request('append', { 'row': transition_to_row(transition) })
+
+  def read_history(self, rooms, doors, history=None):
+    decoder = TransitionDecoder(rooms, doors)
+    history = history if history is not None else History()
+    for row in self.request('transitions')['transitions']:
+      history.record(decoder.decode(row), from_file=True)
+    print("Read history for {} rooms.".format(len(history)))
+    return history
+
+  def segment_stats(self):
+    result = self.request('segment_stats')
+    segments = [ RemoteSingleSegmentStats(
+      segment=RemoteSegment(s['id'], s['name'], s['brief_name']),
+      segment_success_count=s['success_count'],
+      rate=s['success_rate'],
+      p50=decode_frame_count(s['median_time']),
+      p0=decode_frame_count(s['best_time']),
+      sob=decode_frame_count(s['sum_of_best_times']))
+      for s in result['segments'] ]
+    return RemoteSegmentStats(
+        segments=segments,
+        total_p50=decode_frame_count(result['total_median_time']),
+        total_p0=decode_frame_count(result['total_best_time']),
+        total_sob=decode_frame_count(result['total_sum_of_best_times']))
+
+  def transition_stats(self, **options):
+    result = self.request('transition_stats', options)
+    return [ TransitionStats(
+      room=s['room'],
+      n=s['n'],
+      best=decode_frame_count(s['best']),
+      p25=decode_frame_count(s['p25']),
+      p50=decode_frame_count(s['p50']),
+      p75=decode_frame_count(s['p75']),
+      p90=decode_frame_count(s['p90']),
+      save=decode_frame_count(s['save']),
+      most_recent=decode_frame_count(s['most_recent']),
+      save_most_recent=decode_frame_count(s['save_most_recent']),
+      items=s['items'],
+      beams=s['beams']) for s in result['stats'] ]
+
+  def follow(self):
+    # Wait for the server to register us before returning, so no
+    # transition appended after this call is missed
+    self.request('follow')
+    return self._follow()
+
+  def _follow(self):
+    while True:
+      msg_type, row = self.receive()
+      yield row
+
@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+
+from rooms import Rooms
+from doors import Doors
+from transition import Transition, TransitionId
+from transition_log import read_transition_log, FileTransitionLog
+from history import History, retention_policy
+from route import build_route
+from splits import Splits, read_split_names_from_file
+from segment_stats import SplitStatsTracker
+from stats import compute_transition_stats
+from history_client import default_socket_path, encode_frame_count, encode_transition
+
+import argparse
+import json
+import os
+import queue
+import socket
+import socketserver
+import threading
+
+class HistoryService(object):
+  """
+  Owns the history for a single log file.  All appends to the file go
+  through the service, and clients ask the service for stats instead of
+  reading the file themselves.
+  """
+
+  def __init__(self, filename, rooms, doors, split_names=None, history=None):
+    self.filename = filename
+    self.rooms = rooms
+    self.doors = doors
+    self.lock = threading.Lock()
+    self.followers = [ ]
+
+    self.history = history if history is not None else History()
+    if os.path.exists(filename):
+      self.history = read_transition_log(filename, rooms, doors, self.history)
+
+    self.route = build_route(self.history)
+    self.split_segments = Splits.from_segment_and_split_names(
+        [ ], split_names or [ ], rooms, self.route)
+    self.split_stats = SplitStatsTracker(self.history, self.split_segments)
+    self.transition_log = FileTransitionLog(filename)
+
+  def close(self):
+    self.transition_log.close()
+
+  def handle(self, msg_type, payload):
+    handler = getattr(self, 'handle_%s' % msg_type, None)
+    if handler is None:
+      raise ValueError('Unknown message type: %s' % msg_type)
+    with self.lock:
+      return handler(payload)
+
+  def handle_append(self, payload):
+    transition = Transition.from_csv_row(self.rooms, self.doors, payload['row'])
+    self.history.record(transition)
+    self.transition_log.write_transition(transition)
+    for follower in self.followers:
+      follower.put(payload['row'])
+    return { 'transitions': len(self.history.all_transitions) }
+
+  def handle_transitions(self, payload):
+    return { 'transitions': [ encode_transition(transition)
+      for transition in self.history.all_transitions ] }
+
+  def handle_room_stats(self, payload):
+    tid = TransitionId.from_id(payload['room'], self.rooms, self.doors)
+    attempts = self.history.get(tid)
+    if attempts is None:
+      return { 'attempts': 0 }
+
+    times = attempts.totalrealtimes
+    return {
+      'attempts': len(attempts),
+      'best_time': encode_frame_count(times.best()),
+      'mean_time': encode_frame_count(times.mean()),
+      'median_time': encode_frame_count(times.median()),
+      'p25_time': encode_frame_count(times.percentile(25)),
+      'p75_time': encode_frame_count(times.percentile(75)),
+    }
+
+  def handle_segment_stats(self, payload):
+    stats = self.split_stats.segment_stats()
+    return {
+      'segments': [ {
+        'id': seg.segment.id,
+        'name': seg.segment.name,
+        'brief_name': seg.segment.brief_name,
+        'success_count': seg.segment_success_count,
+        'success_rate': seg.rate,
+        'median_time': encode_frame_count(seg.p50),
+        'best_time': encode_frame_count(seg.p0),
+        'sum_of_best_times': encode_frame_count(seg.sob),
+      } for seg in stats.segments ],
+      'total_median_time': encode_frame_count(stats.total_p50),
+      'total_best_time': encode_frame_count(stats.total_p0),
+      'total_sum_of_best_times': encode_frame_count(stats.total_sob),
+    }
+
+  def handle_transition_stats(self, payload):
+    ids = self.route if payload.get('route') else self.history.keys()
+    all_stats = compute_transition_stats(self.history, ids,
+        start_room=payload.get('start_room'),
+        end_room=payload.get('end_room'),
+        iqr=payload.get('iqr', False),
+        exclude_doors=payload.get('exclude_doors', False),
+        doors_only=payload.get('doors_only', False))
+    return { 'stats': [ {
+      'room': str(s.room),
+      'n': s.n,
+      'best': encode_frame_count(s.best),
+      'p25': encode_frame_count(s.p25),
+      'p50': encode_frame_count(s.p50),
+      'p75': encode_frame_count(s.p75),
+      'p90': encode_frame_count(s.p90),
+      'save': encode_frame_count(s.save),
+      'most_recent': encode_frame_count(s.most_recent),
+      'save_most_recent': encode_frame_count(s.save_most_recent),
+      'items': s.items,
+      'beams': s.beams,
+    } for s in all_stats ] }
+
+  def follow(self):
+    q = queue.Queue()
+    with self.lock:
+      self.followers.append(q)
+    return q
+
+  def unfollow(self, q):
+    with self.lock:
+      self.followers.remove(q)
+
+class HistoryRequestHandler(socketserver.StreamRequestHandler):
+  def handle(self):
+    service = self.server.service
+
+    for line in self.rfile:
+      try:
+        msg_type, payload = json.loads(line)
+      except (ValueError, TypeError) as e:
+        self.send([ 'error', 'Invalid message: %s' % e ])
+        continue
+
+      if msg_type == 'follow':
+        self.handle_follow(service)
+        return
+
+      try:
+        response = [ 'ok', service.handle(msg_type, payload) ]
+      except Exception as e:
+        response = [ 'error', '%s' % e ]
+
+      self.send(response)
+
+  def handle_follow(self, service):
+    q = service.follow()
+    try:
+      self.send([ 'ok', { } ])
+      while True:
+        self.send([ 'transition', q.get() ])
+    except (BrokenPipeError, ConnectionResetError):
+      pass
+    finally:
+      service.unfollow(q)
+
+  def send(self, msg):
+    self.wfile.write(json.dumps(msg).encode() + b'\n')
+    self.wfile.flush()
+
+class HistoryServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+  daemon_threads = True
+
+  def __init__(self, socket_path, service):
+    self.service = service
+    if os.path.exists(socket_path):
+      if is_socket_live(socket_path):
+        raise RuntimeError('A history server is already running on %s' % socket_path)
+      # Left behind by a server that did not shut down cleanly
+      os.unlink(socket_path)
+    socketserver.UnixStreamServer.__init__(self, socket_path, HistoryRequestHandler)
+
+  def server_close(self):
+    socketserver.UnixStreamServer.server_close(self)
+    if os.path.exists(self.server_address):
+      os.unlink(self.server_address)
+
+def is_socket_live(socket_path):
+  sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+  try:
+    sock.connect(socket_path)
+    return True
+  except OSError:
+    return False
+  finally:
+    sock.close()
+
+def main():
+  parser = argparse.ArgumentParser(description='SM Room Timer History Server')
+  parser.add_argument('-f', '--file', dest='filename', required=True)
+  parser.add_argument('--rooms', dest='rooms_filename', default='rooms.json')
+  parser.add_argument('--doors', dest='doors_filename', default='doors.json')
+  parser.add_argument('--split', dest='splits', action='append', default=[])
+  parser.add_argument('--splits', dest='splits_filename')
+  parser.add_argument('--socket', dest='socket_path', default=default_socket_path())
+  parser.add_argument('--keep-attempts', dest='keep_attempts', type=int)
+  parser.add_argument('--keep-days', dest='keep_days', type=float)
+  parser.add_argument('--sketch', dest='sketch_k', type=int)
+  parser.add_argument('--histogram', action='store_true')
+  args = parser.parse_args()
+
+  rooms = Rooms.read(args.rooms_filename)
+  doors = Doors.read(args.doors_filename, rooms)
+
+  split_names = args.splits
+
+  if args.splits_filename is not None:
+    split_names.extend(read_split_names_from_file(args.splits_filename))
+
+  history = History(
+      retention=retention_policy(args.keep_attempts, args.keep_days),
+      sketch_k=args.sketch_k,
+      histogram=args.histogram)
+  service = HistoryService(args.filename, rooms, doors, split_names, history)
+
+  try:
+    with HistoryServer(args.socket_path, service) as server:
+      print('Serving history for %s on %s' % (args.filename, args.socket_path))
+      server.serve_forever()
+
+  finally:
+    service.close()
+
+if __name__ == '__main__':
+  main()
@@ -56,11 +56,42 @@ class SparseMemory(MemoryMixin):
 
     return SparseMemory(*regions)
 
-  def __getitem__(self, addr):
+  @staticmethod
+  def from_buffer(buf, *addresses):
+    buf = memoryview(buf)
+    regions = [ ]
+    offset = 0
+
+    for addr, size in addresses:
+      regions.append(MemoryRegion(addr, buf[offset:offset+size]))
+      offset += size
+
+    return SparseMemory(*regions)
+
+  def _region_for(self, addr):
     for region in self.regions:
       if addr >= region.start and addr < region.start + len(region):
-        return region[addr]
+        return region
+
+  def __getitem__(self, addr):
+    region = self._region_for(addr)
+    if region is not None:
+      return region[addr]
+
+    self._out_of_range(addr)
+
+  def slice(self, addr, size):
+    """
+    Returns a view of size bytes starting at addr, without copying.  The
+    bytes must all be in the same region.
+    """
+    region = self._region_for(addr)
+    if region is None or addr + size > region.start + len(region):
+      self._out_of_range(addr)
+    offset = addr - region.start
+    return memoryview(region.s)[offset:offset+size]
 
+  def _out_of_range(self, addr):
     valid_regions = [ (r.start, r.start + len(r) - 1) for r in self.regions ]
     raise IndexError("address 0x%x out of range (valid ranges: %s)" %
         (addr, ', '.join([ '0x%x-0x%x' % r for r in valid_regions ])))
@@ -0,0 +1,127 @@
+import numpy as np
+
+import os
+
+from typing import NamedTuple
+
+SIDES = ( None, 'LEFT', 'RIGHT' )
+SPEEDS = ( None, 'SLOW', 'MID', 'FAST' )
+
+# Kinds of per-round values
+VOLLEY = 0
+DOPPLER_SHOT = 1
+DOPPLER_HIT = 2
+
+FIGHT_DTYPE = np.dtype([
+  ('timestamp', '<f8'),
+  ('fight_time', '<u4'),
+  ('rounds', '<u2'),
+  ('sub_rounds', '<u2'),
+])
+
+ROUND_DTYPE = np.dtype([
+  ('fight', '<u4'),
+  ('round', '<u2'),
+  ('sub_round', '<u2'),
+  ('side', 'u1'),
+  ('speed', 'u1'),
+  ('eye_close_speed', 'u1'),
+  ('missed_eye_close', 'u1'),
+  ('damage', '<u2'),
+])
+
+VALUE_DTYPE = np.dtype([
+  ('fight', '<u4'),
+  ('round', '<u2'),
+  ('sub_round', '<u2'),
+  ('kind', 'u1'),
+  ('value', '<u2'),
+])
+
+class FightLogArrays(NamedTuple):
+  fights: np.ndarray
+  rounds: np.ndarray
+  values: np.ndarray
+
+class PhantoonFightLog(object):
+  """
+  An append-only log of Phantoon fights, stored as three files of
+  fixed-size records (fights, rounds, and per-round values such as
+  volleys and doppler timings), so the whole log can be loaded straight
+  into numpy arrays.
+  """
+
+  def __init__(self, filename):
+    self.filename = filename
+    self.fights_file = open(filename + '.fights', 'ab')
+    self.rounds_file = open(filename + '.rounds', 'ab')
+    self.values_file = open(filename + '.values', 'ab')
+    self.num_fights = self.fights_file.tell() // FIGHT_DTYPE.itemsize
+
+    # Drop a partial fight record from an interrupted write, so the next
+    # fight is written at a whole-record offset
+    self.fights_file.truncate(self.num_fights * FIGHT_DTYPE.itemsize)
+    self.fights_file.seek(0, os.SEEK_END)
+
+    self._truncate_incomplete(self.rounds_file, ROUND_DTYPE)
+    self._truncate_incomplete(self.values_file, VALUE_DTYPE)
+
+  def _truncate_incomplete(self, f, dtype):
+    # Drop records from a fight that was interrupted before its fight
+    # record was written, so they are not attributed to the next fight
+    records = _read_records(f.name, dtype)
+    keep = np.searchsorted(records['fight'], self.num_fights)
+    f.truncate(keep * dtype.itemsize)
+    f.seek(0, os.SEEK_END)
+
+  def close(self):
+    self.fights_file.close()
+    self.rounds_file.close()
+    self.values_file.close()
+
+  def write_fight(self, fight, timestamp):
+    fight_idx = self.num_fights
+
+    rounds = np.zeros(len(fight.rounds), dtype=ROUND_DTYPE)
+    values = [ ]
+    for idx, r in enumerate(fight.rounds):
+      rounds[idx] = (fight_idx, r.round_num, r.sub_round_num,
+          SIDES.index(r.side), SPEEDS.index(r.speed),
+          SPEEDS.index(r.eye_close_speed), r.missed_eye_close,
+          min(max(r.damage, 0), 0xffff))
+      for kind, l in ((VOLLEY, r.volleys), (DOPPLER_SHOT, r.doppler_timings),
+          (DOPPLER_HIT, r.doppler_hit_timings)):
+        values.extend((fight_idx, r.round_num, r.sub_round_num, kind,
+          min(max(v, 0), 0xffff)) for v in l)
+
+    fights = np.array([ (timestamp, fight.fight_time, fight.round_count,
+      fight.sub_round_count) ], dtype=FIGHT_DTYPE)
+
+    # Write the fight last, so a partially written fight is never counted
+    self.values_file.write(np.array(values, dtype=VALUE_DTYPE).tobytes())
+    self.rounds_file.write(rounds.tobytes())
+    self.values_file.flush()
+    self.rounds_file.flush()
+    self.fights_file.write(fights.tobytes())
+    self.fights_file.flush()
+
+    self.num_fights += 1
+
+def _read_records(filename, dtype):
+  if not os.path.exists(filename):
+    return np.zeros(0, dtype=dtype)
+
+  # Ignore a trailing partial record from an interrupted write
+  count = os.path.getsize(filename) // dtype.itemsize
+  return np.fromfile(filename, dtype=dtype, count=count)
+
+def read_fight_log(filename):
+  fights = _read_records(filename + '.fights', FIGHT_DTYPE)
+  rounds = _read_records(filename + '.rounds', ROUND_DTYPE)
+  values = _read_records(filename + '.values', VALUE_DTYPE)
+
+  # Rounds and values for a fight that was never completed
+  rounds = rounds[rounds['fight'] < len(fights)]
+  values = values[values['fight'] < len(fights)]
+
+  return FightLogArrays(fights, rounds, values)
@@ -7,36 +7,83 @@ from history import History
 from transition_log import read_transition_log, read_transition_log_incrementally
 from route import Route, build_route, is_ceres_escape
 from transition import Transition
-from stats import TransitionStats, transition_stats, ceres_cutscene_stats, door_stats
+from stats import TransitionStats, RunningTransitionStats, ceres_cutscene_stats, door_stats
 
 from scipy import stats
 import argparse
 import csv
 
-def progression_stats(filename, route, rooms, doors, start_room=None, end_room=None):
+class RouteTotals(object):
+  """
+  Running totals of the per-transition stats for a route.  When the
+  stats for a transition change, only that transition's contribution to
+  the totals is updated.
+
+  A percentile of whole frame counts is always a multiple of 1/100 of a
+  frame, so the totals are kept as exact integers in hundredths of a
+  frame; adding and subtracting floats would let rounding error build
+  up over a long log.
+  """
+
+  FIELDS = ( 'best', 'p25', 'p50', 'p75', 'p90' )
+
+  def __init__(self):
+    self.stats = { }
+    self.totals = dict.fromkeys(self.FIELDS, 0)
+
+  def replace(self, key, new):
+    old = self.stats.get(key)
+    for field in self.FIELDS:
+      if old is not None:
+        self.totals[field] -= round(getattr(old, field).count * 100)
+      self.totals[field] += round(getattr(new, field).count * 100)
+    self.stats[key] = new
+
+  def seconds(self, field):
+    # Hundredths of a frame are sixths of a millisecond
+    total = self.totals[field]
+    if total % 6 != 3:
+      return round(total / 6) / 1000
+
+    # Exactly halfway between two milliseconds.  Which way this rounds
+    # has always depended on the rounding error in the float sum of the
+    # stats, so sum them the same way to keep the output unchanged.
+    count = sum(getattr(s, field).count for s in self.stats.values())
+    return round(count / 60.0 * 1000) / 1000
+
+def progression_stats(filename, route, rooms, doors, start_room=None,
+    end_room=None, exclude_doors=False, doors_only=False):
   printing = False if start_room else True
 
-  all_stats = { }
+  running_stats = { }
+  totals = RouteTotals()
   route = Route()
 
-  for history, transition in read_transition_log_incrementally(args.filename, rooms, doors):
+  for history, transition in read_transition_log_incrementally(filename, rooms, doors):
     tid = transition.id
     route.record(tid, verbose=False)
 
     if tid in route:
       if start_room == tid.room.name: printing = True
       if end_room == tid.room.name: break
-      if not printing: continue
 
-      attempts = history[tid]
+      stats = running_stats.get(tid)
+      if stats is None:
+        stats = RunningTransitionStats(tid, iqr=True,
+            exclude_doors=exclude_doors, doors_only=doors_only)
+        running_stats[tid] = stats
+      stats.append(transition)
 
-      all_stats[tid] = transition_stats(tid, attempts, iqr=True,
-        exclude_doors=args.exclude_doors, doors_only=args.doors_only)
+      if not printing: continue
 
-      if is_ceres_escape(tid) and not args.doors_only:
-        all_stats['ceres cutscene'] = ceres_cutscene_stats(tid, attempts, iqr=True)
+      totals.replace(tid, stats.stats())
 
-      yield transition, all_stats
+      if is_ceres_escape(tid) and not doors_only:
+        attempts = history[tid]
+        totals.replace('ceres cutscene',
+            ceres_cutscene_stats(tid, attempts, iqr=True))
+
+      yield transition, totals.stats, totals
 
 if __name__ == '__main__':
   parser = argparse.ArgumentParser(description='Graph Progression')
@@ -59,20 +106,16 @@ if __name__ == '__main__':
 
   print('Timestamp,Room,Route Sum of Best,Route Sum of P25,Route Sum of P50,Route Sum of P75,Route Sum of P90')
 
-  for transition, all_stats in progression_stats(args.filename, route,
-      rooms, doors, start_room=args.start_room, end_room=args.end_room):
-
-    p0 = FrameCount(sum([ s.best.count for s in all_stats.values() ]))
-    p25 = FrameCount(sum([ s.p25.count for s in all_stats.values() ]))
-    p50 = FrameCount(sum([ s.p50.count for s in all_stats.values() ]))
-    p75 = FrameCount(sum([ s.p75.count for s in all_stats.values() ]))
-    p90 = FrameCount(sum([ s.p90.count for s in all_stats.values() ]))
+  for transition, all_stats, totals in progression_stats(args.filename,
+      route, rooms, doors, start_room=args.start_room,
+      end_room=args.end_room, exclude_doors=args.exclude_doors,
+      doors_only=args.doors_only):
 
     print('%s,%s,%s,%s,%s,%s,%s' % (
       transition.ts,
       transition.id.room,
-      round(p0.to_seconds(), 3),
-      round(p25.to_seconds(), 3),
-      round(p50.to_seconds(), 3),
-      round(p75.to_seconds(), 3),
-      round(p90.to_seconds(), 3)))
+      totals.seconds('best'),
+      totals.seconds('p25'),
+      totals.seconds('p50'),
+      totals.seconds('p75'),
+      totals.seconds('p90')))
@@ -0,0 +1,130 @@
+import math
+import random
+
+class KLLSketch(object):
+  """
+  Approximate quantiles for a stream of values in O(k log(n/k)) space,
+  using the compactor hierarchy from Karnin, Lang and Liberty, "Optimal
+  Quantile Approximation in Streams".  Sketches built from different
+  streams (e.g. different log files) can be merged.
+
+  Until the sketch first fills up it holds every value, so quantiles of
+  small sets are exact.
+  """
+
+  def __init__(self, k=200, c=2.0/3.0, seed=None):
+    self.k = k
+    self.c = c
+    self.compactors = [ [ ] ]
+    self.size = 0
+    self.max_size = self._capacity(0)
+    self.count = 0
+    self.min = None
+    self.max = None
+    self._random = random.Random(seed)
+    self._sorted = None
+
+  def normalized_rank_error(self):
+    # Empirical bound (99% confidence) from the DataSketches KLL
+    # implementation; about 1.3% for k=200.
+    return 2.296 / self.k ** 0.9723
+
+  def _capacity(self, height):
+    depth = len(self.compactors) - height - 1
+    return int(math.ceil(self.c ** depth * self.k)) + 1
+
+  def _grow(self):
+    self.compactors.append([ ])
+    self.max_size = sum(self._capacity(h) for h in range(len(self.compactors)))
+
+  def _compact(self, height):
+    items = self.compactors[height]
+    items.sort()
+
+    # An odd item out stays behind so no weight is lost
+    leftover = items.pop() if len(items) % 2 else None
+    offset = self._random.randint(0, 1)
+    self.compactors[height + 1].extend(items[offset::2])
+    items.clear()
+    if leftover is not None:
+      items.append(leftover)
+
+  def _compress(self):
+    for height in range(len(self.compactors)):
+      if len(self.compactors[height]) >= self._capacity(height):
+        if height + 1 >= len(self.compactors):
+          self._grow()
+        self._compact(height)
+        self.size = sum(len(items) for items in self.compactors)
+        if self.size < self.max_size:
+          break
+
+  def update(self, value):
+    self.compactors[0].append(value)
+    self.size += 1
+    self.count += 1
+    if self.min is None or value < self.min: self.min = value
+    if self.max is None or value > self.max: self.max = value
+    self._sorted = None
+    if self.size >= self.max_size:
+      self._compress()
+
+  def merge(self, other):
+    while len(self.compactors) < len(other.compactors):
+      self._grow()
+    for height, items in enumerate(other.compactors):
+      self.compactors[height].extend(items)
+    self.size = sum(len(items) for items in self.compactors)
+    self.count += other.count
+    if other.min is not None and (self.min is None or other.min < self.min): self.min = other.min
+    if other.max is not None and (self.max is None or other.max > self.max): self.max = other.max
+    self._sorted = None
+    while self.size >= self.max_size:
+      self._compress()
+
+  def _weighted_items(self):
+    if self._sorted is None:
+      items = sorted(
+          (value, 1 << height)
+          for height, values in enumerate(self.compactors)
+          for value in values)
+      cumulative = [ ]
+      total = 0
+      for value, weight in items:
+        total += weight
+        cumulative.append(total)
+      self._sorted = ([ value for value, weight in items ], cumulative)
+    return self._sorted
+
+  def rank(self, value):
+    """
+    Approximate fraction of values less than or equal to value.
+    """
+    values, cumulative = self._weighted_items()
+    lo, hi = 0, len(values)
+    while lo < hi:
+      mid = (lo + hi) // 2
+      if values[mid] <= value: lo = mid + 1
+      else: hi = mid
+    return cumulative[lo - 1] / cumulative[-1] if lo > 0 else 0.0
+
+  def quantile(self, q):
+    """
+    Approximate value at quantile q (0 <= q <= 1).
+    """
+    if q <= 0: return self.min
+    if q >= 1: return self.max
+    values, cumulative = self._weighted_items()
+    target = q * cumulative[-1]
+    lo, hi = 0, len(values) - 1
+    while lo < hi:
+      mid = (lo + hi) // 2
+      if cumulative[mid] < target: lo = mid + 1
+      else: hi = mid
+    return values[lo]
+
+  def __len__(self):
+    return self.count
+
+  def __repr__(self):
+    return 'KLLSketch(k=%d, count=%d, size=%d)' % (self.k, self.count, self.size)
@@ -40,8 +40,7 @@ class WebsocketClient(object):
   async def read_core_ram_async(self, addr, size):
     full_addr = 0xF50000 + addr
     await self.send_async('GetAddress', '%X' % (full_addr), '%X' % size)
-    res = await self.ws.recv()
-    return [ c for c in res ]
+    return await self.ws.recv()
 
   def read_core_ram(self, addr, size):
     return asyncio.get_event_loop().run_until_complete(
@@ -52,13 +51,15 @@ class WebsocketClient(object):
     pairs = [ ( '%X' % (0xF50000 + addr), '%X' % size ) for addr, size in addrs ]
     args = [ arg for pair in pairs for arg in pair ]
     await self.send_async('GetAddress', *args)
-    received_bytes = [ ]
-    while len(received_bytes) < size:
-      res = await self.ws.recv()
-      received_bytes.extend([ c for c in res ])
+    received = await self.ws.recv()
+    if len(received) < size:
+      received = bytearray(received)
+      while len(received) < size:
+        received += await self.ws.recv()
+    buf = memoryview(received)
     sizes = [ size for addr, size in addrs ]
     offsets = list(itertools.accumulate([0, *sizes]))[0:-1]
-    results = [ received_bytes[offset:offset+size] for offset, size in zip(offsets, sizes) ]
+    results = [ buf[offset:offset+size] for offset, size in zip(offsets, sizes) ]
     return results
 
   def read_core_ram_multi(self, addrs):
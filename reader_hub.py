@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+
+from memory import SparseMemory
+
+import argparse
+import asyncio
+import socketserver
+import threading
+import time
+
+DEFAULT_PORT = 55356
+
+def merge_addresses(addresses):
+  """
+  Merges a collection of (addr, size) pairs into the smallest sorted list
+  of non-overlapping (addr, size) pairs that covers all of them.
+  """
+  merged = [ ]
+  for addr, size in sorted(addresses):
+    if merged and addr <= merged[-1][0] + merged[-1][1]:
+      start, prev_size = merged[-1]
+      merged[-1] = (start, max(prev_size, addr + size - start))
+    else:
+      merged.append((addr, size))
+  return merged
+
+class ReaderHub(object):
+  """
+  Reads memory for any number of watchers with a single connection.
+  Once per frame, the hub reads the union of the addresses its clients
+  have asked for, and each client's reads are answered from the most
+  recent snapshot instead of going to the emulator.
+
+  A client's addresses are dropped from the hub's reads once it has not
+  read anything for IDLE_TIMEOUT seconds (or once it is closed), and are
+  added again the next time it reads.
+  """
+
+  IDLE_TIMEOUT = 5.0
+
+  def __init__(self, create_sock, interval=1.0/60):
+    self.create_sock = create_sock
+    self.interval = interval
+    self.clients = [ ]
+    self.cond = threading.Condition()
+    self.addresses = [ ]
+    self.generation = 0
+    self.snapshot = None
+    self.snapshot_generation = -1
+    self.done = False
+    self.thread = threading.Thread(target=self._run, daemon=True)
+
+  def start(self):
+    self.done = False
+    self.thread.start()
+
+  def stop(self):
+    with self.cond:
+      self.done = True
+      self.cond.notify_all()
+    self.thread.join()
+
+  def is_alive(self):
+    return self.thread.is_alive()
+
+  def attach(self):
+    client = HubClient(self)
+    with self.cond:
+      self.clients.append(client)
+    return client
+
+  def detach(self, client):
+    with self.cond:
+      if client in self.clients:
+        self.clients.remove(client)
+        self._update_addresses()
+
+  def _expire_idle_clients(self):
+    now = time.monotonic()
+    expired = False
+    for client in self.clients:
+      if client.addresses and now - client.last_read > self.IDLE_TIMEOUT:
+        client.addresses.clear()
+        expired = True
+    if expired:
+      self._update_addresses()
+
+  def _update_addresses(self):
+    addresses = merge_addresses(
+        address for client in self.clients for address in client.addresses)
+    if addresses != self.addresses:
+      self.addresses = addresses
+      self.generation += 1
+      self.cond.notify_all()
+
+  def read(self, client, addresses):
+    with self.cond:
+      client.last_read = time.monotonic()
+      if not client.addresses.issuperset(addresses):
+        client.addresses.update(addresses)
+        self._update_addresses()
+
+      # Wait for a snapshot that covers every address this client wants
+      generation = self.generation
+      while (self.snapshot_generation < generation and not self.done
+          and self.thread.is_alive()):
+        self.cond.wait(1.0)
+
+      if self.snapshot_generation < generation:
+        return None
+
+      mem = self.snapshot
+
+    if mem is None:
+      return None
+
+    return [ mem.slice(addr, size) for addr, size in addresses ]
+
+  def _run(self):
+    asyncio.set_event_loop(asyncio.new_event_loop())
+    sock = self.create_sock()
+
+    try:
+      deadline = time.monotonic()
+
+      while True:
+        with self.cond:
+          self._expire_idle_clients()
+          while not self.addresses and not self.done:
+            self.cond.wait()
+          if self.done:
+            break
+          addresses = self.addresses
+          generation = self.generation
+
+        mem = SparseMemory.read_from(sock, *addresses)
+
+        with self.cond:
+          self.snapshot = mem
+          self.snapshot_generation = generation
+          self.cond.notify_all()
+
+        deadline += self.interval
+        delay = deadline - time.monotonic()
+        if delay > 0:
+          time.sleep(delay)
+        else:
+          deadline = time.monotonic()
+
+    finally:
+      sock.close()
+
+class HubClient(object):
+  """
+  A connection to a ReaderHub, with the same read methods as the
+  emulator sockets, so it can be passed anywhere a socket is expected.
+  """
+
+  def __init__(self, hub):
+    self.hub = hub
+    self.addresses = set()
+    self.last_read = time.monotonic()
+
+  def close(self):
+    self.hub.detach(self)
+
+  def read_core_ram(self, addr, size):
+    results = self.read_core_ram_multi([ (addr, size) ])
+    return results[0] if results is not None else None
+
+  def read_core_ram_multi(self, addrs):
+    return self.hub.read(self, [ (addr, size) for addr, size in addrs ])
+
+class HubRequestHandler(socketserver.BaseRequestHandler):
+  """
+  Answers READ_CORE_RAM commands the way RetroArch does, so any program
+  that can talk to RetroArch can read through the hub instead.
+  """
+
+  def handle(self):
+    data, sock = self.request
+    client = self.server.client_for(self.client_address)
+
+    addresses = [ ]
+    for line in data.decode(errors='replace').splitlines():
+      words = line.split()
+      if len(words) == 3 and words[0] == 'READ_CORE_RAM':
+        try:
+          addresses.append((int(words[1], 16), int(words[2])))
+        except ValueError:
+          pass
+
+    # A zero-length read is how clients check that we are listening
+    to_read = [ (addr, size) for addr, size in addresses if size > 0 ]
+    results = client.read_core_ram_multi(to_read) if to_read else [ ]
+    if results is None:
+      return
+    results = iter(results)
+
+    for addr, size in addresses:
+      vals = next(results) if size > 0 else b''
+      response = 'READ_CORE_RAM %x %s\n' % (addr, vals.hex(' '))
+      sock.sendto(response.encode(), self.client_address)
+
+class HubServer(socketserver.ThreadingMixIn, socketserver.UDPServer):
+  daemon_threads = True
+
+  # Forget a remote client's addresses when it has not asked for
+  # anything in this long
+  CLIENT_TIMEOUT = 5.0
+
+  def __init__(self, port, hub, addr='127.0.0.1'):
+    self.hub = hub
+    self.clients = { }
+    self.clients_lock = threading.Lock()
+    socketserver.UDPServer.__init__(self, (addr, port), HubRequestHandler)
+
+  def client_for(self, client_address):
+    now = time.monotonic()
+    with self.clients_lock:
+      for key, (client, last_used) in list(self.clients.items()):
+        if key != client_address and now - last_used > self.CLIENT_TIMEOUT:
+          del self.clients[key]
+          client.close()
+
+      client, last_used = self.clients.get(client_address, (None, None))
+      if client is None:
+        client = self.hub.attach()
+      self.clients[client_address] = (client, now)
+      return client
+
+def main():
+  parser = argparse.ArgumentParser(description='SM Room Timer Reader Hub')
+  client_type_group = parser.add_mutually_exclusive_group(required=True)
+  client_type_group.add_argument('--usb2snes', dest='client_type', action='store_const', const='usb2snes')
+  client_type_group.add_argument('--retroarch', dest='client_type', action='store_const', const='retroarch')
+  parser.add_argument('--retroarch-port', dest='retroarch_port', type=int)
+  parser.add_argument('--port', dest='port', type=int, default=DEFAULT_PORT)
+  args = parser.parse_args()
+
+  from sm_room_timer import create_sock
+
+  hub = ReaderHub(lambda: create_sock(args.client_type, port=args.retroarch_port))
+  hub.start()
+
+  try:
+    with HubServer(args.port, hub) as server:
+      print('Serving %s reads on port %s' % (args.client_type, args.port))
+      server.serve_forever()
+
+  finally:
+    hub.stop()
+
+if __name__ == '__main__':
+  main()
@@ -1,6 +1,6 @@
 #!/usr/bin/env python3
 
-from transition import Transition
+from transition import Transition, TransitionId
 from rooms import Rooms, NullRoom
 from doors import Doors, NullDoor
 
@@ -51,7 +51,12 @@ def rebuild_history(rooms, doors, input_filenames, output_filename):
             if l:
               if len(l) == 1:
                 print("Fixing entry door on line %d" % n)
-                transition.id.entry_door = list(l.keys())[0].entry_door
+                # Transition ids are interned, so build a new id rather
+                # than modifying the shared one
+                tid = transition.id
+                transition = transition._replace(id=TransitionId(
+                  tid.room, list(l.keys())[0].entry_door, tid.exit_door,
+                  tid.items, tid.beams))
               else:
                 print("More than one entry door found for %s to $s (line %d): %s" %
                     (transition.id.room, transition.id.exit_room, n,
@@ -1,5 +1,8 @@
+import os
 import socket
 import select
+import tempfile
+import time
 # import random
 
 import sys
@@ -14,24 +17,114 @@ class DefaultLogger(object):
   def log_verbose(self, x):
     pass
 
+def default_port_cache_path():
+  return os.path.join(tempfile.gettempdir(), 'sm_room_timer_retroarch_port')
+
+def read_cached_port(path):
+  try:
+    with open(path) as f:
+      return int(f.read().strip())
+  except (OSError, ValueError):
+    return None
+
+def write_cached_port(path, port):
+  try:
+    with open(path, 'w') as f:
+      f.write('%d\n' % port)
+  except OSError:
+    pass
+
+def probe_ports(addr, ports, timeout=0.25):
+  """
+  Sends a zero-length read to every port at once and returns the first
+  port that answers, or None if none answer within the timeout.
+  """
+  socks = { }
+  try:
+    for port in ports:
+      if port in socks.values(): continue
+      sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+      sock.connect((addr, port))
+      socks[sock] = port
+      try:
+        sock.send(b'READ_CORE_RAM 0 0\n')
+      except OSError:
+        pass
+
+    deadline = time.monotonic() + timeout
+    pending = list(socks)
+    while pending:
+      remaining = deadline - time.monotonic()
+      if remaining <= 0: break
+      r, w, e = select.select(pending, [], [], remaining)
+      for sock in r:
+        try:
+          msg = sock.recv(1024)
+        except OSError:
+          # e.g. connection refused; nothing is listening on this port
+          pending.remove(sock)
+          continue
+        if msg.startswith(b'READ_CORE_RAM'):
+          return socks[sock]
+
+    return None
+
+  finally:
+    for sock in socks:
+      sock.close()
+
 class NetworkCommandSocket(object):
-  def __init__(self, port=55355, addr='127.0.0.1', logger=None):
+  DEFAULT_PORTS = ( 55355, 55354, 55435 )
+
+  def __init__(self, port=None, addr='127.0.0.1', logger=None,
+      port_cache_path=None):
     self.logger = logger or DefaultLogger()
 
-    try:
+    # Probe every candidate port at once (the port we used last time
+    # first), and fall back to trying them one at a time if none of
+    # them answer quickly
+    port_cache_path = port_cache_path or default_port_cache_path()
+    cached_port = None
+    if port is not None:
+      ports = [ port ]
+    else:
+      cached_port = read_cached_port(port_cache_path)
+      ports = [ cached_port ] if cached_port is not None else [ ]
+      ports.extend(self.DEFAULT_PORTS)
+
+    found_port = probe_ports(addr, ports)
+    if found_port is None:
+      # The cached port is only a guess, and is no better than the
+      # defaults once it has stopped answering
+      if port is None:
+        ports = list(self.DEFAULT_PORTS)
+      found_port = self._init_slow(addr, ports)
+    else:
+      self._init(addr, found_port)
+
+    if port is None and found_port is not None and found_port != cached_port:
+      write_cached_port(port_cache_path, found_port)
+
+  def _init_slow(self, addr, ports):
+    for port in ports:
       try:
         self._init(addr, port)
-      except:
-        port = 55354
-        self._init(addr, port)
-    except:
-      port = 55435
-      self._init(addr, port)
+        return port
+      except (OSError, RuntimeError):
+        pass
+
+    # Nothing answered (e.g. RetroArch is not running yet); use the
+    # first port and let the caller keep retrying its reads
+    self.connect(addr, ports[0])
+    self.logger.log("Connected on %s (not responding)" % ports[0])
+    return None
 
   def _init(self, addr, port):
     self.connect(addr, port)
     self.logger.log("Connected on %s" % port)
-    self.read_core_ram(0, 0)
+    if self.read_core_ram(0, 0) is None:
+      self.close()
+      raise RuntimeError("No response from RetroArch on port %s" % port)
     self.logger.log("OK")
 
   def connect(self, addr, port):
@@ -95,7 +188,7 @@ class NetworkCommandSocket(object):
         # response = self.read_response()
       if response is None:
         return None
-      words = response.split()
+      words = response.split(maxsplit=2)
       if words[0] != b'READ_CORE_RAM':
         self.logger.log(
             "Expected response for %s but got response for %s: %s" % (
@@ -106,8 +199,12 @@ class NetworkCommandSocket(object):
             "Expected response for address %s but got response for address %s: %s" % (
               b'%x' % addr, words[1], response))
         continue
-      vals = [ int(field, 16) for field in words[2:] ]
-      return vals
+      if len(words) < 3:
+        return b''
+      if words[2].strip() == b'-1':
+        self.logger.log("Could not read %d bytes at address %x" % (size, addr))
+        return None
+      return bytes.fromhex(words[2].decode())
 
   def read_core_ram_multi(self, addrs):
     self.clear_responses()
@@ -14,11 +14,21 @@ def should_ignore_transition(tid):
 
 class Route(object):
   def __init__(self, ids=None):
-    self._ids = ids or [ ]
+    self._ids = [ ]
+    self._positions = { }
+    self._ids_by_room = { }
     self._seen_transitions = { }
     self._next_room = None
     self.complete = False
 
+    for tid in ids or [ ]:
+      self._append(tid)
+
+  def _append(self, tid):
+    self._positions[tid] = len(self._ids)
+    self._ids_by_room.setdefault(tid.room, [ ]).append(tid)
+    self._ids.append(tid)
+
   def record(self, tid, verbose=True):
     if should_ignore_transition(tid):
       if verbose:
@@ -29,7 +39,7 @@ class Route(object):
     if not seen:
       self._seen_transitions[tid] = True
       if self._next_room is None or tid.room is self._next_room:
-        self._ids.append(tid)
+        self._append(tid)
         self._next_room = tid.exit_door.exit_room
       else:
         if verbose:
@@ -39,15 +49,17 @@ class Route(object):
       self.complete = True
 
   def find_nth_transition_by_room(self, room, n):
-    for tid in self:
-      if tid.room == room:
-        n -= 1
-        if n <= 0:
-          return tid
+    tids = self._ids_by_room.get(room, [ ])
+    if tids and n <= len(tids):
+      # As before, n <= 0 finds the first occurrence
+      return tids[max(n, 1) - 1]
 
     route = ", ".join(id.room.name for id in self)
     raise RuntimeError("Could not find %s in route: %s" % (room.name, route))
 
+  def index(self, tid):
+    return self._positions[tid]
+
   def __len__(self):
     return len(self._ids)
 
@@ -55,7 +67,7 @@ class Route(object):
     return iter(self._ids)
 
   def __contains__(self, tid):
-    return tid in self._ids
+    return tid in self._positions
 
   def __getitem__(self, idx):
     return self._ids[idx]
@@ -17,13 +17,11 @@ class Segment(object):
 
   @classmethod
   def from_route(cls, route, start=None, end=None):
-    in_segment = False
-    tids = [ ]
-    for tid in route:
-      if tid == start: in_segment = True
-      if in_segment: tids.append(tid)
-      if tid == end: break
-    return Segment(tids)
+    if start not in route:
+      return Segment()
+    start_idx = route.index(start)
+    end_idx = route.index(end) if end in route else len(route) - 1
+    return Segment(route[start_idx:end_idx+1])
 
   @property
   def id(self):
@@ -68,7 +66,7 @@ class Segment(object):
     else:
       return self.tids[key]
 
-  def __contains(self, tid):
+  def __contains__(self, tid):
     return tid in self.tids
 
   def extend_to(self, tid):
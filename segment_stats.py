@@ -13,6 +13,9 @@ from sm_segment_timer import find_segment_in_history
 
 import sys
 import argparse
+import bisect
+import multiprocessing
+from collections import deque
 from dataclasses import dataclass
 
 def sum_of_best(segment, history):
@@ -21,6 +24,48 @@ def sum_of_best(segment, history):
     total += history[tid].totalrealtimes.best()
   return total
 
+class SumOfBestCache(object):
+  """
+  Prefix sums of the best time for each transition along a route, so the
+  sum of best for a segment of the route is a range query.  The sums
+  are updated only when a transition sets a new best.
+  """
+
+  def __init__(self, tids, history):
+    self.tids = [ ]
+    self.positions = { }
+    self.bests = [ ]
+    for tid in tids:
+      if tid in self.positions: continue
+      self.positions[tid] = len(self.tids)
+      self.tids.append(tid)
+      self.bests.append(history[tid].totalrealtimes.best())
+
+    self.prefix = [ FrameCount(0) ]
+    for best in self.bests:
+      self.prefix.append(self.prefix[-1] + best)
+
+  def record(self, transition):
+    idx = self.positions.get(transition.id)
+    if idx is None: return
+
+    time = transition.time.totalrealtime
+    if time < self.bests[idx]:
+      delta = time - self.bests[idx]
+      self.bests[idx] = time
+      for i in range(idx + 1, len(self.prefix)):
+        self.prefix[i] += delta
+
+  def sum_of_best(self, segment):
+    start = self.positions.get(segment.start)
+    end = self.positions.get(segment.end)
+    if start is not None and end is not None and end - start + 1 == len(segment.tids):
+      return self.prefix[end + 1] - self.prefix[start]
+
+    # The segment is not a contiguous part of the route we were built
+    # with
+    return sum((self.bests[self.positions[tid]] for tid in segment), FrameCount(0))
+
 def print_room_stats(history, segment_history, segments):
   for segment in segments:
     print("Segment: \033[1m%s\033[m" % segment)
@@ -83,6 +128,243 @@ def print_room_stats(history, segment_history, segments):
     print(table.render())
     print('')
 
+def median_of_sorted(values):
+  # Same result as statistics.median, but without sorting
+  n = len(values)
+  mid = n // 2
+  if n % 2 == 1:
+    return values[mid]
+  else:
+    return (values[mid - 1] + values[mid]) / 2
+
+class SegmentTimes(object):
+  """
+  The times of the completed attempts at a segment, in sorted order.
+  If a RetentionPolicy is given, times are dropped by the same rule the
+  history uses to drop attempts, so only the times of attempts the
+  history still keeps are counted.
+  """
+
+  def __init__(self, retention=None):
+    self.retention = retention
+    self.attempts = deque() # last transition of each attempt, oldest first
+    self.unsorted = deque()
+    self.sorted = [ ]
+
+  def append(self, transition, time):
+    self.attempts.append(transition)
+    self.unsorted.append(time)
+    bisect.insort(self.sorted, time)
+
+    if self.retention is not None:
+      while self.retention.expired(self):
+        self._popleft()
+
+  def discard(self, transition):
+    # Attempts are discarded oldest first, so if the time for this one
+    # is still kept, it is the oldest
+    if self.attempts and self.attempts[0] is transition:
+      self._popleft()
+
+  def _popleft(self):
+    self.attempts.popleft()
+    time = self.unsorted.popleft()
+    del self.sorted[bisect.bisect_left(self.sorted, time)]
+
+  def __getitem__(self, idx):
+    return self.sorted[idx]
+
+  def __len__(self):
+    return len(self.sorted)
+
+class SegmentAttempt(object):
+  """
+  The transitions in a single attempt at a segment, and whether the
+  attempt is currently counted as an attempt and as a success.
+  """
+
+  def __init__(self):
+    self.transitions = [ ]
+    self.counted = False
+    self.succeeded = False
+
+class SegmentStatsTracker(object):
+  """
+  Incrementally tracks the attempts, successes, times, and sum of best
+  for a single segment as transitions are recorded in the history.
+
+  If the history has a retention policy, an attempt stops being counted
+  once the history discards any of the transitions it would need to
+  find the attempt again (see expire()), so the stats always match a
+  tracker built from the transitions the history still has.
+  """
+
+  def __init__(self, segment, history, sob_cache=None):
+    self.segment = segment
+    self.attempt_count = 0
+    self.success_count = 0
+    self.times = SegmentTimes(history.retention)
+    self.sob_cache = sob_cache if sob_cache is not None else SumOfBestCache(segment, history)
+    self.is_ceres_escape = any(( is_ceres_escape(tid) for tid in segment ))
+
+    # The number of transitions matched so far in the segment attempt
+    # that is in progress (0 if there is no attempt in progress) and the
+    # time so far for that attempt.
+    self.in_progress = 0
+    self.in_progress_time = 0
+    self.attempt = None
+
+    # The attempts that reached each position in the segment, oldest
+    # first, so the attempt a discarded transition belonged to can be
+    # found
+    self.positions = { }
+    for idx, tid in enumerate(segment.tids):
+      self.positions.setdefault(tid, idx)
+    self.attempts_by_position = [ deque() for tid in segment.tids ] \
+        if history.retention is not None else None
+
+    # Replay the history starting at each attempt of the first room in
+    # the segment (skipping any we already visited while following the
+    # previous attempt).
+    all_transitions = history.all_transitions
+    next_idx = 0
+    for idx in history.indexes_by_tid.get(segment.start, [ ]):
+      if idx < next_idx: continue
+      self.record(all_transitions[idx])
+      while self.in_progress > 0 and idx + 1 < len(all_transitions):
+        idx += 1
+        transition = all_transitions[idx]
+        if transition is None:
+          # Discarded by the history's retention policy
+          self.abandon()
+          break
+        self.record(transition)
+      next_idx = idx + 1
+
+  def record(self, transition):
+    tids = self.segment.tids
+    tid = transition.id
+
+    if 0 < self.in_progress < len(tids) and tid == tids[self.in_progress]:
+      self._extend(transition)
+    elif tid == self.segment.start:
+      self.abandon()
+      self.attempt = SegmentAttempt()
+      self._extend(transition)
+    else:
+      self.abandon()
+
+    # The cache may be shared with other trackers, but recording the
+    # same transition again does nothing
+    self.sob_cache.record(transition)
+
+  @property
+  def sob(self):
+    return self.sob_cache.sum_of_best(self.segment)
+
+  def abandon(self):
+    self.in_progress = 0
+    self.in_progress_time = 0
+    self.attempt = None
+
+  def expire(self, transition):
+    """
+    Stops counting the attempt that transition was part of, after the
+    history's retention policy has discarded it.
+    """
+    if self.attempts_by_position is None: return
+
+    # The history discards the oldest transitions for each room first,
+    # so the transition belongs to the oldest attempt that reached its
+    # position, if to any
+    position = self.positions.get(transition.id)
+    if position is None: return
+    attempts = self.attempts_by_position[position]
+    if not attempts or attempts[0].transitions[position] is not transition:
+      return
+    attempt = attempts.popleft()
+
+    if attempt is self.attempt:
+      self.abandon()
+
+    if attempt.counted and position < min(2, len(self.segment.tids)):
+      attempt.counted = False
+      self.attempt_count -= 1
+
+    if attempt.succeeded:
+      attempt.succeeded = False
+      self.success_count -= 1
+      self.times.discard(attempt.transitions[-1])
+
+  def _extend(self, transition):
+    tids = self.segment.tids
+    attempt = self.attempt
+    self.in_progress += 1
+    self.in_progress_time += transition.time.totalrealtime.count
+
+    attempt.transitions.append(transition)
+    if self.attempts_by_position is not None:
+      self.attempts_by_position[self.in_progress - 1].append(attempt)
+
+    # The number of segment attempts is the number of times we attempted
+    # the first two rooms in the segment in succession.
+    if self.in_progress == min(2, len(tids)):
+      attempt.counted = True
+      self.attempt_count += 1
+
+    if self.in_progress == len(tids):
+      self.times.append(transition, self.in_progress_time)
+      attempt.succeeded = True
+      self.success_count += 1
+      self.abandon()
+
+class SplitStatsTracker(object):
+  """
+  Keeps a SegmentStatsTracker for each split segment up to date with the
+  history, visiting only the segments affected by each new transition.
+  Transitions are fed to the trackers as the history records them, and
+  the trackers are told when the history's retention policy discards
+  them, so the stats match SegmentStats built from the history.
+  """
+
+  def __init__(self, history, segments):
+    self.history = history
+    self.segments = segments
+    self.sob_cache = SumOfBestCache(
+        (tid for segment in segments for tid in segment), history)
+    self.trackers = [ SegmentStatsTracker(segment, history, self.sob_cache)
+        for segment in segments ]
+    self.trackers_by_segment = { id(t.segment): t for t in self.trackers }
+    self.trackers_by_tid = { }
+    for tracker in self.trackers:
+      for tid in tracker.segment:
+        self.trackers_by_tid.setdefault(tid, [ ]).append(tracker)
+    self.in_progress = set(t for t in self.trackers if t.in_progress > 0)
+    history.subscribe(self.record)
+    history.subscribe_expired(self.expire)
+
+  def record(self, transition):
+    trackers = self.trackers_by_tid.get(transition.id, ())
+    for tracker in self.in_progress.difference(trackers):
+      tracker.abandon()
+    self.in_progress.clear()
+
+    for tracker in trackers:
+      tracker.record(transition)
+      if tracker.in_progress > 0:
+        self.in_progress.add(tracker)
+
+  def expire(self, transition):
+    for tracker in self.trackers_by_tid.get(transition.id, ()):
+      tracker.expire(transition)
+
+  def single_segment_stats(self, segment):
+    tracker = self.trackers_by_segment[id(segment)]
+    return SingleSegmentStats(segment, self.history, tracker=tracker)
+
+  def segment_stats(self):
+    return SegmentStats(self.history, self.segments, trackers=self.trackers)
+
 @dataclass
 class SingleSegmentStats(object):
   """
@@ -93,28 +375,26 @@ class SingleSegmentStats(object):
   p0: FrameCount
   sob: FrameCount
 
-  def __init__(self, segment, history):
+  def __init__(self, segment, history, tracker=None):
     self.segment = segment
 
-    successful_attempts = find_segment_in_history(segment, history)
-    # The number of segment attempts is the number of times we attempted
-    # the first three rooms in the segment in succession.
-    all_attempts = find_segment_in_history(segment[0:2], history)
-    self.segment_attempt_count = len(all_attempts)
+    if tracker is None:
+      tracker = SegmentStatsTracker(segment, history)
 
-    self.segment_success_count = len(successful_attempts)
+    self.segment_attempt_count = tracker.attempt_count
+    self.segment_success_count = tracker.success_count
     self.rate = self.segment_success_count / self.segment_attempt_count if self.segment_attempt_count > 0 else 0
 
-    if len(successful_attempts.totalrealtimes) > 0:
-      self.p50 = successful_attempts.totalrealtimes.median()
-      self.p0 = successful_attempts.totalrealtimes.best()
+    if len(tracker.times) > 0:
+      self.p50 = FrameCount(median_of_sorted(tracker.times))
+      self.p0 = FrameCount(tracker.times[0])
     else:
       self.p50 = None
       self.p0 = None
 
-    self.sob = sum_of_best(segment, history)
+    self.sob = tracker.sob
 
-    if any(( is_ceres_escape(tid) for tid in segment )):
+    if tracker.is_ceres_escape:
       self.p50 += FrameCount(2591)
       self.p0 += FrameCount(2591)
       self.sob += FrameCount(2591)
@@ -130,22 +410,26 @@ class SegmentStats(object):
   total_p0: FrameCount
   total_sob: FrameCount
 
-  def __init__(self, history, segments):
+  def __init__(self, history, segments, trackers=None, single_segment_stats=None):
     self.segments = [ ]
     self.total_p50 = FrameCount(0)
     self.total_p0 = FrameCount(0)
     self.total_sob = FrameCount(0)
 
-    for segment in segments:
-      stats = SingleSegmentStats(segment, history)
+    for idx, segment in enumerate(segments):
+      if single_segment_stats is not None:
+        stats = single_segment_stats[idx]
+      else:
+        tracker = trackers[idx] if trackers is not None else None
+        stats = SingleSegmentStats(segment, history, tracker=tracker)
       self.segments.append(stats)
 
       if stats.p50 is not None: self.total_p50 += stats.p50
       if stats.p0 is not None: self.total_p0 += stats.p0
       if stats.sob is not None: self.total_sob += stats.sob
 
-def print_segment_stats(history, segments):
-  stats = SegmentStats(history, segments)
+def print_segment_stats(history, segments, stats=None):
+  stats = stats or SegmentStats(history, segments)
 
   table = Table()
 
@@ -187,6 +471,56 @@ def build_segment_history(segments, history):
         segment_history.record(transition)
   return segment_history
 
+# Set in the parent before the worker pool is forked, so the workers
+# share the parent's copy of the history instead of each one receiving a
+# pickled copy.
+_worker_history = None
+_worker_segments = None
+
+def _segment_report(idx):
+  segment = _worker_segments[idx]
+  attempts = find_segment_in_history(segment, _worker_history)
+  start_indexes = [ attempt.start_index for attempt in attempts ]
+
+  # The segment holds transition ids that refer to the worker's copy of
+  # the rooms and doors, so the parent re-attaches its own segment.
+  stats = SingleSegmentStats(segment, _worker_history)
+  stats.segment = None
+
+  return start_indexes, stats
+
+def build_segment_reports(segments, history, jobs):
+  """
+  Find each segment's attempts and compute its SingleSegmentStats in a
+  pool of worker processes.  Returns the segment history (as built by
+  build_segment_history) and the SegmentStats for all the segments.
+  """
+
+  global _worker_history, _worker_segments
+  _worker_history = history
+  _worker_segments = segments
+
+  try:
+    with multiprocessing.get_context('fork').Pool(jobs) as pool:
+      reports = pool.map(_segment_report, range(len(segments)))
+  finally:
+    _worker_history = None
+    _worker_segments = None
+
+  segment_history = History()
+  single_segment_stats = [ ]
+  for segment, (start_indexes, stats) in zip(segments, reports):
+    for start_idx in start_indexes:
+      for idx in range(start_idx, start_idx + len(segment.tids)):
+        segment_history.record(history.all_transitions[idx])
+    stats.segment = segment
+    single_segment_stats.append(stats)
+
+  stats = SegmentStats(history, segments,
+      single_segment_stats=single_segment_stats)
+
+  return segment_history, stats
+
 def main():
   parser = argparse.ArgumentParser(description='SM Room Timer')
   parser.add_argument('-f', '--file', dest='filename', default=None)
@@ -196,6 +530,7 @@ def main():
   parser.add_argument('--split', dest='splits', action='append', default=[])
   parser.add_argument('--splits', dest='splits_filename')
   parser.add_argument('--brief', action='store_true')
+  parser.add_argument('-j', '--jobs', type=int, default=1)
   args = parser.parse_args()
 
   rooms = Rooms.read(args.rooms_filename)
@@ -216,10 +551,23 @@ def main():
       rooms,
       route)
 
-  if not args.brief:
-    segment_history = build_segment_history(split_segments, history)
-    print_room_stats(history, segment_history, split_segments)
-  print_segment_stats(history, split_segments)
+  # Fork is needed so the workers can share the history with the
+  # parent; where it is not available, fall back to computing the
+  # reports serially.
+  can_fork = 'fork' in multiprocessing.get_all_start_methods()
+
+  if args.jobs > 1 and can_fork:
+    segment_history, stats = build_segment_reports(split_segments,
+        history, args.jobs)
+    if not args.brief:
+      print_room_stats(history, segment_history, split_segments)
+    print_segment_stats(history, split_segments, stats)
+
+  else:
+    if not args.brief:
+      segment_history = build_segment_history(split_segments, history)
+      print_room_stats(history, segment_history, split_segments)
+    print_segment_stats(history, split_segments)
 
 if __name__ == '__main__':
   main()
@@ -414,15 +414,20 @@ class Histogram extends Chart {
     this.elem.classList.add('histogram');
   }
 
-  plot({values, n, format}) {
-    const max = Math.max(...values);
-    const min = Math.min(...values);
+  plot({values, histogram, n, format}) {
+    // A histogram is { lo, counts }, where counts[i] is the number of
+    // values equal to lo + i
+    const entries = histogram !== undefined
+      ? histogram.counts.map((c,i) => [ histogram.lo + i, c ]).filter(([v,c]) => c > 0)
+      : values.map(v => [ v, 1 ]);
+    const max = Math.max(...entries.map(([v,c]) => v));
+    const min = Math.min(...entries.map(([v,c]) => v));
     const bins = new Array(n).fill(0);
     const bin_width = (max - min) / (n - 1);
 
-    values.forEach((v) => {
+    entries.forEach(([v,c]) => {
       const idx = Math.floor((v - min) / bin_width);
-      bins[idx] += 1;
+      bins[idx] += c;
     });
 
     const xlim = [ 0, n ];
@@ -918,6 +923,7 @@ const redraw_attempt_history_charts = function(data) {
 
       const histogram_plot = attempt_histogram.plot({
         values: times,
+        histogram: data.histograms !== undefined ? data.histograms[name] : undefined,
         n: 27,
         format: v => fc(v),
         classes: [ 'hidden' ],
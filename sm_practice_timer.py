@@ -5,11 +5,12 @@ from doors import Doors, NullDoor
 from route import Route, DummyRoute
 from rebuild_history import need_rebuild, rebuild_history
 from transition_log import read_transition_log, FileTransitionLog, NullTransitionLog
-from history import History
-from sm_room_timer import backup_and_rebuild, ThreadedStateReader
+from history import History, retention_policy
+from history_client import HistoryClient, default_socket_path
+from sm_room_timer import backup_and_rebuild, ThreadedStateReader, SubprocessStateReader
 from sm_segment_timer import SegmentTimerTerminalFrontend, SegmentTimeTracker, SegmentTimer, find_segment_in_history
-from segment_stats import SegmentStats, SingleSegmentStats
-from splits import Splits, read_split_names_from_file
+from segment_stats import SegmentStats, SingleSegmentStats, SplitStatsTracker
+from splits import Splits, read_split_names_from_file, index_segments_by_transition
 
 from segment import Segment
 from transition import TransitionId, TransitionTime
@@ -128,10 +129,28 @@ def apply_to_attempts(attempts, func):
       realtime_door=func(attempts.doorrealtimes),
       doortime_is_real=True)
 
+def encode_recent_stats(attempts):
+  d = { }
+
+  recent = attempts.recent()
+  if recent is not None:
+    d['recent_attempts'] = len(recent)
+    d['recent_mean_time'] = encode_transition_time(apply_to_attempts(recent, lambda l: l.summarize().mean))
+    d['recent_median_time'] = encode_transition_time(apply_to_attempts(recent, lambda l: l.summarize().p50))
+    d['recent_p25_time'] = encode_transition_time(apply_to_attempts(recent, lambda l: l.summarize().p25))
+    d['recent_p75_time'] = encode_transition_time(apply_to_attempts(recent, lambda l: l.summarize().p75))
+
+  if attempts.totalrealtimes.ewma() is not None:
+    d['ewma_time'] = encode_transition_time(apply_to_attempts(attempts, FrameCountList.ewma))
+
+  return d
+
 class JsonEventGenerator(object):
   def __init__(self, on_event, split_segments, debug_log=None, verbose=False):
     self.on_event = on_event
     self.split_segments = split_segments
+    self.split_segments_by_tid = index_segments_by_transition(split_segments)
+    self.split_stats_tracker = None
     self.debug_log = debug_log
     self.verbose = verbose
 
@@ -160,11 +179,13 @@ class JsonEventGenerator(object):
     if len(l) > 0: self.emit('state_changed', l)
 
   def new_room_time(self, transition, attempts, tracker):
-    best = apply_to_attempts(attempts, FrameCountList.best)
-    mean = apply_to_attempts(attempts, FrameCountList.mean)
-    median = apply_to_attempts(attempts, FrameCountList.median)
-    p25 = apply_to_attempts(attempts, lambda l: FrameCountList.percentile(l, 25))
-    p75 = apply_to_attempts(attempts, lambda l: FrameCountList.percentile(l, 75))
+    # Each series is sorted once, and the summary is shared with the
+    # other frontends until the next attempt is recorded
+    best = apply_to_attempts(attempts, lambda l: l.summarize().best)
+    mean = apply_to_attempts(attempts, lambda l: l.summarize().mean)
+    median = apply_to_attempts(attempts, lambda l: l.summarize().p50)
+    p25 = apply_to_attempts(attempts, lambda l: l.summarize().p25)
+    p75 = apply_to_attempts(attempts, lambda l: l.summarize().p75)
 
     segment_attempt = tracker.current_attempt
     old_segment_stats = tracker.current_attempt_old_stats
@@ -179,13 +200,14 @@ class JsonEventGenerator(object):
     self.emit('new_room_time', {
       'room': {
         **encode_transition_id(transition.id),
-        'attempts': len(attempts),
+        'attempts': attempts.total_count,
         'time': encode_transition_time(transition.time),
         'best_time': encode_transition_time(best),
         'mean_time': encode_transition_time(mean),
         'median_time': encode_transition_time(median),
         'p25_time': encode_transition_time(p25),
         'p75_time': encode_transition_time(p75),
+        **encode_recent_stats(attempts),
       },
       'segment': {
         'id': segment.id,
@@ -201,6 +223,8 @@ class JsonEventGenerator(object):
         'new_best_time': new_segment_stats.totalrealtime_p0,
         'new_p25_time': new_segment_stats.totalrealtime_p25,
         'new_p75_time': new_segment_stats.totalrealtime_p75,
+        **({ 'recent_median_time': new_segment_stats.totalrealtime_recent_p50 }
+           if new_segment_stats.totalrealtime_recent_p50 is not None else { }),
       },
       'room_in_segment': {
         'attempts': new_room_in_segment_stats.num_attempts,
@@ -216,15 +240,22 @@ class JsonEventGenerator(object):
       },
     })
 
-    for split_segment in self.split_segments:
-      if transition.id in split_segment:
-        self.send_single_segment_stats(split_segment, tracker.history)
+    for split_segment in self.split_segments_by_tid.get(transition.id, ()):
+      self.send_single_segment_stats(split_segment, tracker.history)
 
   def new_segment(self, transition):
     self.emit('new_segment', {
       'start': encode_transition_id(transition.id),
     })
 
+  def split_stats(self, history):
+    # The first time we need split stats, we walk the history to build a
+    # tracker for each split; after that the trackers are updated only
+    # with the new transitions.
+    if self.split_stats_tracker is None:
+      self.split_stats_tracker = SplitStatsTracker(history, self.split_segments)
+    return self.split_stats_tracker
+
   def send_single_segment_stats(self, segment, history):
     # TODO: In new_room_time, we have SegmentAttemptStats (both before
     # and after the transition is processed), which mostly tracks the
@@ -233,7 +264,7 @@ class JsonEventGenerator(object):
     # (in many cases we will need to build SingleSegmentStats anyway, if
     # the start/end for SegmentAttemptStats don't line up with one of
     # the splits)
-    seg = SingleSegmentStats(segment, history)
+    seg = self.split_stats(history).single_segment_stats(segment)
 
     # TODO: This is mostly the same as send_segment_stats, below -- is
     # there a way we can consolidate?
@@ -253,9 +284,10 @@ class JsonEventGenerator(object):
     })
 
   def send_initial_segment_stats(self, session, history, split_segments):
-    # TODO: This is very slow for a large file, so we don't want
-    # websockets conncting/disconnecting often
-    stats = SegmentStats(history, split_segments)
+    if split_segments is self.split_segments:
+      stats = self.split_stats(history).segment_stats()
+    else:
+      stats = SegmentStats(history, split_segments)
 
     segments = [ {
       'id': seg.segment.id,
@@ -277,14 +309,27 @@ class JsonEventGenerator(object):
     transitions = [ history.all_transitions[idx] for idx in indexes ]
 
     times = [ {
-      'timestamp': transition.ts.isoformat(),
+      'timestamp': transition.isoformat(),
       **encode_transition_time(transition.time)
     } for transition in transitions ]
 
-    self.send(session, 'room_history', {
+    msg = {
       'room': encode_transition_id(tid),
       'times': times,
-    })
+    }
+
+    attempts = history.get(tid)
+    if attempts is not None and attempts.totalrealtimes.histogram() is not None:
+      msg['histograms'] = {
+        'room-game': attempts.gametimes.histogram().as_dict(),
+        'room-real': attempts.realtimes.histogram().as_dict(),
+        'room-lag': attempts.roomlagtimes.histogram().as_dict(),
+        'door-real': attempts.doorrealtimes.histogram().as_dict(),
+        'door-lag': attempts.doorlagtimes.histogram().as_dict(),
+        'total-real': attempts.totalrealtimes.histogram().as_dict(),
+      }
+
+    self.send(session, 'room_history', msg)
 
   def send_segment_history(self, session, segment_id, history, route, rooms, doors):
     if route is None: return
@@ -292,7 +337,7 @@ class JsonEventGenerator(object):
     attempts = find_segment_in_history(segment, history)
 
     times = [ {
-      'timestamp': attempt.transitions[0].ts.isoformat(),
+      'timestamp': attempt.transitions[0].isoformat(),
       **encode_transition_time(attempt.time)
     } for attempt in attempts ]
 
@@ -307,7 +352,9 @@ class JsonEventGenerator(object):
 
 class TimerThread(object):
   def __init__(self, history, rooms, doors, transition_log, route,
-      json_generator, server, client_type, split_segments):
+      json_generator, server, client_type, split_segments,
+      tiered_polling=False, adaptive_polling=False, reader_process=False,
+      retroarch_port=None):
 
     self.history = history
     self.rooms = rooms
@@ -323,9 +370,17 @@ class TimerThread(object):
         on_new_room_time=self.json_generator.new_room_time,
         on_new_segment=self.json_generator.new_segment)
 
-    self.state_reader = ThreadedStateReader(
-        rooms, doors,
-        client_type=client_type, logger=json_generator)
+    if reader_process:
+      self.state_reader = SubprocessStateReader(
+          rooms, doors,
+          client_type=client_type, logger=json_generator,
+          port=retroarch_port)
+    else:
+      self.state_reader = ThreadedStateReader(
+          rooms, doors,
+          client_type=client_type, logger=json_generator,
+          tiered=tiered_polling, adaptive=adaptive_polling,
+          port=retroarch_port)
 
     self.timer = SegmentTimer(
         self.json_generator, self.state_reader,
@@ -403,6 +458,9 @@ class TimerThread(object):
           route=self.route,
           rooms=self.rooms,
           doors=self.doors)
+    elif msg_type == 'reader_metrics':
+      self.json_generator.send(session, 'reader_metrics',
+          self.state_reader.metrics.as_dict())
     else:
       print("Unknown message type:", msg_type)
 
@@ -549,8 +607,20 @@ def main():
   client_type_group = parser.add_mutually_exclusive_group(required=True)
   client_type_group.add_argument('--usb2snes', dest='client_type', action='store_const', const='usb2snes')
   client_type_group.add_argument('--retroarch', dest='client_type', action='store_const', const='retroarch')
+  parser.add_argument('--retroarch-port', dest='retroarch_port', type=int)
   parser.add_argument('--route', action='store_true')
   parser.add_argument('--rebuild', action='store_true')
+  parser.add_argument('--tiered-polling', dest='tiered_polling', action='store_true')
+  parser.add_argument('--adaptive-polling', dest='adaptive_polling', action='store_true')
+  parser.add_argument('--reader-process', dest='reader_process', action='store_true')
+  parser.add_argument('--history-server', dest='history_server', nargs='?', const=default_socket_path())
+  parser.add_argument('--keep-attempts', dest='keep_attempts', type=int)
+  parser.add_argument('--keep-days', dest='keep_days', type=float)
+  parser.add_argument('--sketch', dest='sketch_k', type=int)
+  parser.add_argument('--histogram', action='store_true')
+  parser.add_argument('--recent-attempts', dest='recent_attempts', type=int)
+  parser.add_argument('--recent-days', dest='recent_days', type=float)
+  parser.add_argument('--ewma', dest='ewma_alpha', type=float)
   parser.add_argument('--port', type=int, default=15000)
   parser.add_argument('--headless', action='store_true')
   parser.add_argument('--zoom', type=float)
@@ -570,10 +640,18 @@ def main():
     debug_log = None
     verbose = args.verbose
 
-  if args.filename is not None and os.path.exists(args.filename):
-    history = read_transition_log(args.filename, rooms, doors)
-  else:
-    history = History()
+  history = History(
+      retention=retention_policy(args.keep_attempts, args.keep_days),
+      sketch_k=args.sketch_k,
+      histogram=args.histogram,
+      recent_window=retention_policy(args.recent_attempts, args.recent_days),
+      ewma_alpha=args.ewma_alpha)
+
+  if args.history_server is not None:
+    history_client = HistoryClient(args.history_server)
+    history = history_client.read_history(rooms, doors, history)
+  elif args.filename is not None and os.path.exists(args.filename):
+    history = read_transition_log(args.filename, rooms, doors, history)
 
   if args.route or args.splits_filename or args.splits or args.segments:
     route = Route()
@@ -618,7 +696,12 @@ def main():
         on_event=server.broadcast,
         split_segments=split_segments)
 
-    transition_log = FileTransitionLog(args.filename) if args.filename is not None else NullTransitionLog()
+    if args.history_server is not None:
+      transition_log = history_client
+    elif args.filename is not None:
+      transition_log = FileTransitionLog(args.filename)
+    else:
+      transition_log = NullTransitionLog()
 
     tracker = SegmentTimeTracker(
         history, transition_log, route,
@@ -627,7 +710,10 @@ def main():
 
     timer_thread = TimerThread(history, rooms, doors, transition_log,
         route, json_generator, server, client_type=args.client_type,
-        split_segments=split_segments)
+        split_segments=split_segments, tiered_polling=args.tiered_polling,
+        adaptive_polling=args.adaptive_polling,
+        reader_process=args.reader_process,
+        retroarch_port=args.retroarch_port)
     timer_thread.start()
     shutdown.append(timer_thread.stop)
 
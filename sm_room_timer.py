@@ -5,11 +5,14 @@ from qusb2snes.websocket_client import WebsocketClient
 from rooms import Rooms, NullRoom
 from doors import Doors, NullDoor
 from frame_count import FrameCount
-from transition import TransitionId, TransitionTime, Transition
+from transition import TransitionId, TransitionTime, Transition, timestamp_to_us
 from transition_log import read_transition_log, FileTransitionLog, NullTransitionLog
-from history import History
+from history import History, retention_policy
+from history_client import HistoryClient, default_socket_path
 from route import Route, DummyRoute
-from state import State, NullState
+from state import State, NullState, Sentinel, SHIP_STATE_ADDRESSES
+from memory import SparseMemory
+from snapshot_ring import SnapshotRing
 from state_change import StateChange
 from rebuild_history import need_rebuild, rebuild_history
 
@@ -21,6 +24,7 @@ import os.path
 import sys
 import tempfile
 import asyncio
+import multiprocessing
 from threading import Thread
 from queue import Queue
 
@@ -219,7 +223,7 @@ class RoomTimer(object):
     if not self.validate_transition(state):
       return
 
-    ts = datetime.datetime.now()
+    ts = timestamp_to_us(datetime.datetime.now())
     try:
       transition_id = TransitionId(
           self.last_room, self.last_most_recent_door,
@@ -240,7 +244,7 @@ class RoomTimer(object):
     self.on_transitioned(transition)
 
   def handle_escaped_ceres(self, state):
-    ts = datetime.datetime.now()
+    ts = timestamp_to_us(datetime.datetime.now())
     transition_id = TransitionId(
         state.room, state.door, self.state_reader.ceres_elevator,
         state.items, state.beams)
@@ -255,7 +259,7 @@ class RoomTimer(object):
     self.on_transitioned(transition)
 
   def handle_reached_ship(self, state):
-    ts = datetime.datetime.now()
+    ts = timestamp_to_us(datetime.datetime.now())
     transition_id = TransitionId(
         state.room, state.door,
         NullDoor, state.items, state.beams)
@@ -270,14 +274,15 @@ class RoomTimer(object):
     self.on_transitioned(transition)
 
 def color_for_time(ttime, atimes):
+  summary = atimes.summarize()
   color = 8
-  if len(atimes.values()) <= 1 or ttime <= atimes.best():
+  if summary.n <= 1 or ttime <= summary.best:
     color = 214
-  elif ttime <= atimes.percentile(25):
+  elif ttime <= summary.p25:
     color = 40
-  elif ttime <= atimes.median():
+  elif ttime <= summary.p50:
     color = 148
-  elif ttime <= atimes.percentile(75):
+  elif ttime <= summary.p75:
     color = 204
   else:
     color = 196
@@ -308,7 +313,7 @@ class RoomTimerTerminalFrontend(object):
       # When verbose logging is enabled, we  want to minimize the number
       # of lines displayed
       # TODO: Colorize this the same as below
-      self.log('%s #%s:' % (transition.id, len(attempts)))
+      self.log('%s #%s:' % (transition.id, attempts.total_count))
     else:
       # Without verbose logging, we want to minimize the width of the
       # lines we are printing
@@ -319,7 +324,7 @@ class RoomTimerTerminalFrontend(object):
       denom = float(resets + completions)
       success_rate = int(float(completions) / denom * 100) if denom != 0 else 0
       self.log('Room: \033[1m%s\033[m (#%d, %d%% success)' %
-          (transition.id.room, len(attempts), success_rate))
+          (transition.id.room, attempts.total_count, success_rate))
       self.log('Entered from: %s' % transition.id.entry_room)
       self.log('Exited to: %s' % transition.id.exit_room)
 
@@ -331,10 +336,11 @@ class RoomTimerTerminalFrontend(object):
     self.log('')
 
   def colorize(self, ttime, atimes):
-    mean = atimes.mean()
-    best = atimes.best()
-    prev_best = atimes.prev_best()
-    p50 = atimes.median()
+    summary = atimes.summarize()
+    mean = summary.mean
+    best = summary.best
+    prev_best = summary.prev_best
+    p50 = summary.p50
 
     color = color_for_time(ttime, atimes)
 
@@ -368,15 +374,128 @@ def backup_and_rebuild(rooms, doors, filename):
     finally:
       if unlink: os.unlink(tmp.name)
 
+def create_sock(client_type, logger=None, port=None):
+  if client_type == 'usb2snes':
+    return WebsocketClient('sm_room_timer')
+  elif client_type == 'retroarch':
+    return NetworkCommandSocket(port=port, logger=logger)
+  elif client_type is None:
+    raise ValueError('No client type provided')
+  else:
+    raise ValueError('Invalid client type %s' % client_type)
+
+def wait_until(deadline):
+  """
+  Sleeps until the given time.monotonic() deadline, and returns the time
+  the next interval should be scheduled from.
+  """
+  delay = deadline - time.monotonic()
+  if delay > 0:
+    time.sleep(delay)
+    return deadline
+  else:
+    # We are running behind; start over from now rather than trying to
+    # catch up with a burst of polls
+    return time.monotonic()
+
+class ReaderMetrics(object):
+  """
+  Counters kept by a ThreadedStateReader.  They are updated on the
+  reader thread and may be read (approximately) from any thread.
+  """
+
+  def __init__(self):
+    self.polls = 0
+    self.full_reads = 0
+    self.missed_deadlines = 0
+    self.rate_changes = 0
+    self.dropped_snapshots = 0
+    self.interval = None
+    self.polls_by_interval = { }
+
+  def record_poll(self, interval):
+    self.polls += 1
+    if interval != self.interval:
+      if self.interval is not None: self.rate_changes += 1
+      self.interval = interval
+    self.polls_by_interval[interval] = self.polls_by_interval.get(interval, 0) + 1
+
+  def as_dict(self):
+    return {
+      'polls': self.polls,
+      'full_reads': self.full_reads,
+      'missed_deadlines': self.missed_deadlines,
+      'rate_changes': self.rate_changes,
+      'dropped_snapshots': self.dropped_snapshots,
+      'sample_rate': 1.0 / self.interval if self.interval else None,
+      'polls_by_sample_rate': { '%g' % (1.0 / interval): n
+        for interval, n in self.polls_by_interval.items() },
+    }
+
+  def __repr__(self):
+    return 'ReaderMetrics(%s)' % ', '.join([ '%s=%s' % (k,repr(v)) for k,v in
+      self.as_dict().items() ])
+
 class ThreadedStateReader(object):
-  def __init__(self, rooms, doors, client_type, logger):
+  """
+  Reads the game state on a separate thread.
+
+  With tiered polling, each poll reads only a small sentinel (game state,
+  room and IGT), and the full state is read only when the sentinel
+  changes in a way that could produce an event, while a transition is in
+  progress, at the landing site, or every FULL_READ_INTERVAL polls.
+
+  With adaptive polling, polls are paced against a deadline, and the
+  interval between polls depends on the game state: slower in menus,
+  demos and while dying, and faster around transitions and the Ceres
+  and ship special cases, where a missed frame corrupts the times.
+  """
+
+  # Game states in which a transition is in progress, and which need a
+  # full read on every poll
+  TRANSITION_GAME_STATES = ( 0x09, 0x0A, 0x0B )
+
+  # The number of frames IGT may advance between polls without being
+  # treated as a jump (e.g. from loading a preset)
+  MAX_IGT_STEP = 30
+
+  FULL_READ_INTERVAL = 60
+
+  # Game states in which nothing can be timed
+  IDLE_GAME_STATES = frozenset((
+    0x00, 0x01, 0x02, 0x03, 0x04, 0x05, 0x06, 0x07, # title screen and menus
+    0x0D, 0x0E, 0x0F, 0x10, 0x11,                   # pause menu
+    0x13, 0x14, 0x15, 0x16, 0x17, 0x18, 0x19, 0x1A, # dying and game over
+    0x1D, 0x27,                                     # debug menu, credits
+    0x28, 0x29, 0x2A, 0x2B, 0x2C,                   # demos
+  ))
+
+  # Game states (in addition to the transition states) in which we
+  # sample at the maximum rate
+  BURST_GAME_STATES = frozenset((
+    0x20, 0x21, 0x22, # Ceres escape
+    0x26,             # escaping Zebes
+  ))
+
+  IDLE_INTERVAL = 1.0 / 10
+  NORMAL_INTERVAL = 1.0 / 60
+  BURST_INTERVAL = 1.0 / 120
+
+  def __init__(self, rooms, doors, client_type, logger, tiered=False,
+      adaptive=False, port=None):
     self.rooms = rooms
     self.doors = doors
     self.client_type = client_type
+    self.port = port
     self.logger = logger
+    self.tiered = tiered
+    self.adaptive = adaptive
+    self.metrics = ReaderMetrics()
     self.queue = Queue()
     self.thread = Thread(target=self._run)
     self.prev_state = NullState
+    self.prev_sentinel = None
+    self.polls_since_full_read = 0
     self.ceres_elevator = self.doors.from_id(0x88FE)
 
   def start(self):
@@ -397,36 +516,214 @@ class ThreadedStateReader(object):
     sock = self._create_sock()
 
     try:
+      deadline = time.monotonic()
+
       while not self.done:
         at_landing_site = (self.prev_state.room.room_id == 0x91F8)
-        state = State.read_from(sock, self.rooms, self.doors,
-            read_ship_state=at_landing_site)
+        if self.tiered and not self._need_full_read(sock, at_landing_site):
+          state = None
+        else:
+          state = State.read_from(sock, self.rooms, self.doors,
+              read_ship_state=at_landing_site)
+          self.metrics.full_reads += 1
         if state is not None:
           self.queue.put(state)
           self.prev_state = state
-        time.sleep(1.0/60)
+        elif self.tiered:
+          # Nothing we care about changed; hand the timer the last full
+          # state anyway, so its loop (and whatever it services between
+          # polls) keeps running at the poll rate
+          self.queue.put(self.prev_state)
+
+        if self.adaptive:
+          interval = self._poll_interval(at_landing_site)
+          self.metrics.record_poll(interval)
+          deadline = self._wait_until(deadline + interval)
+        else:
+          self.metrics.record_poll(self.NORMAL_INTERVAL)
+          time.sleep(1.0/60)
 
     finally:
       sock.close()
       loop.stop()
 
-  def _create_sock(self):
-    if self.client_type == 'usb2snes':
-      return WebsocketClient('sm_room_timer')
-    elif self.client_type == 'retroarch':
-      # TODO: since we are running in a thread, we should not use the
-      # main logger, since it is not guaranteed to be thread-safe.
-      # Instead, the socket should issue callbacks for events so we can
-      # correctly capture them.
-      return NetworkCommandSocket(logger=self.logger)
-    elif self.client_type is None:
-      raise ValueError('No client type provided')
+  def _poll_interval(self, at_landing_site):
+    if self.prev_sentinel is not None:
+      game_state_id = self.prev_sentinel.game_state_id
+      room_id = self.prev_sentinel.room_id
+    else:
+      game_state_id = getattr(self.prev_state, 'game_state_id', None)
+      room_id = self.prev_state.room.room_id
+
+    if (game_state_id in self.TRANSITION_GAME_STATES
+        or game_state_id in self.BURST_GAME_STATES
+        or at_landing_site or room_id == 0xDF45): # Ceres Elevator
+      return self.BURST_INTERVAL
+    elif game_state_id in self.IDLE_GAME_STATES:
+      return self.IDLE_INTERVAL
     else:
-      raise ValueError('Invalid client type %s' % self.client_type)
+      return self.NORMAL_INTERVAL
+
+  def _wait_until(self, deadline):
+    next_deadline = wait_until(deadline)
+    if next_deadline != deadline:
+      self.metrics.missed_deadlines += 1
+    return next_deadline
+
+  def _need_full_read(self, sock, at_landing_site):
+    sentinel = Sentinel.read_from(sock)
+    if sentinel is None:
+      return False
+
+    prev = self.prev_sentinel
+    self.prev_sentinel = sentinel
+    self.polls_since_full_read += 1
+
+    if (prev is None or at_landing_site
+        or sentinel.game_state_id != prev.game_state_id
+        or sentinel.room_id != prev.room_id
+        or not 0 <= sentinel.igt - prev.igt <= self.MAX_IGT_STEP
+        or sentinel.game_state_id in self.TRANSITION_GAME_STATES
+        or self.polls_since_full_read >= self.FULL_READ_INTERVAL):
+      self.polls_since_full_read = 0
+      return True
+
+    return False
+
+  def _create_sock(self):
+    # TODO: since we are running in a thread, we should not use the main
+    # logger, since it is not guaranteed to be thread-safe.  Instead, the
+    # socket should issue callbacks for events so we can correctly
+    # capture them.
+    return create_sock(self.client_type, self.logger, self.port)
 
   def read_state(self):
     return self.queue.get()
 
+# Set in the flags of a snapshot that includes the ship state
+SNAPSHOT_SHIP_STATE = 0x01
+
+def read_snapshots(ring_name, slots, client_type, port, done):
+  """
+  Entry point for the reader process started by a SubprocessStateReader.
+  Writes a raw snapshot of the state addresses into the ring every frame
+  until done is set.
+  """
+  addresses = State.addresses(read_ship_state=True)
+  num_ship_bytes = sum(size for addr, size in SHIP_STATE_ADDRESSES)
+  snapshot_size = sum(size for addr, size in addresses)
+  room_id_offset = 0x079B - 0x078D
+
+  ring = SnapshotRing(snapshot_size, slots, name=ring_name)
+  asyncio.set_event_loop(asyncio.new_event_loop())
+  sock = create_sock(client_type, port=port)
+
+  try:
+    at_landing_site = False
+
+    while not done.is_set():
+      results = sock.read_core_ram_multi(State.addresses(at_landing_site))
+      timestamp = time.time()
+
+      if results is not None and None not in results:
+        snapshot = bytearray()
+        for s in results: snapshot.extend(s)
+        if at_landing_site:
+          flags = SNAPSHOT_SHIP_STATE
+        else:
+          snapshot.extend(bytes(num_ship_bytes))
+          flags = 0
+        ring.write(snapshot, timestamp, flags)
+
+        room_id = snapshot[room_id_offset] | snapshot[room_id_offset + 1] << 8
+        at_landing_site = (room_id == 0x91F8)
+
+      time.sleep(1.0/60)
+
+  finally:
+    sock.close()
+    ring.close()
+
+class SubprocessStateReader(object):
+  """
+  Reads the game state in a separate process, so sampling is not delayed
+  by work done on this process's threads (which all share the GIL).
+
+  The reader process only copies raw memory into a SnapshotRing; states
+  are decoded here, as they are consumed.
+  """
+
+  RING_SLOTS = 256
+
+  # How long to wait before checking the ring again when there is no new
+  # snapshot
+  IDLE_WAIT = 1.0 / 500
+
+  def __init__(self, rooms, doors, client_type, logger, port=None):
+    self.rooms = rooms
+    self.doors = doors
+    self.logger = logger
+    self.addresses = State.addresses(read_ship_state=True)
+    snapshot_size = sum(size for addr, size in self.addresses)
+    self.ring = SnapshotRing(snapshot_size, self.RING_SLOTS, create=True)
+    self.next_snapshot = 0
+    self.prev_state = NullState
+    self.metrics = ReaderMetrics()
+
+    # Use spawn so the reader process does not inherit a copy of this
+    # process's threads and locks
+    context = multiprocessing.get_context('spawn')
+    self.done = context.Event()
+    self.process = context.Process(
+        target=read_snapshots,
+        args=(self.ring.name, self.RING_SLOTS, client_type, port, self.done),
+        daemon=True)
+
+  def start(self):
+    self.process.start()
+
+  def stop(self):
+    self.done.set()
+    self.process.join()
+    self.ring.close()
+    self.ring.unlink()
+
+  def is_alive(self):
+    return self.process.is_alive()
+
+  def read_state(self):
+    """
+    Returns the next state, or raises RuntimeError once the reader
+    process has exited and every snapshot it wrote has been read.
+    """
+    while True:
+      snapshot = self.ring.read(self.next_snapshot)
+      if snapshot is not None:
+        break
+
+      if self.next_snapshot < self.ring.written:
+        # We fell more than a ring behind and the snapshot was
+        # overwritten; skip to the oldest one the writer cannot be
+        # overwriting right now
+        oldest = max(self.next_snapshot + 1, self.ring.written - self.RING_SLOTS + 1)
+        self.metrics.dropped_snapshots += oldest - self.next_snapshot
+        self.next_snapshot = oldest
+      elif not self.process.is_alive():
+        raise RuntimeError('Reader process exited with code %s' %
+            self.process.exitcode)
+      else:
+        time.sleep(self.IDLE_WAIT)
+
+    timestamp, flags, raw = snapshot
+    self.next_snapshot += 1
+    self.metrics.record_poll(ThreadedStateReader.NORMAL_INTERVAL)
+    self.metrics.full_reads += 1
+
+    read_ship_state = bool(flags & SNAPSHOT_SHIP_STATE)
+    mem = SparseMemory.from_buffer(raw, *self.addresses)
+    self.prev_state = State.decode(mem, self.rooms, self.doors, read_ship_state)
+    return self.prev_state
+
 def main():
   parser = argparse.ArgumentParser(description='SM Room Timer')
   parser.add_argument('-f', '--file', dest='filename', default=None)
@@ -438,8 +735,17 @@ def main():
   client_type_group = parser.add_mutually_exclusive_group(required=True)
   client_type_group.add_argument('--usb2snes', dest='client_type', action='store_const', const='usb2snes')
   client_type_group.add_argument('--retroarch', dest='client_type', action='store_const', const='retroarch')
+  parser.add_argument('--retroarch-port', dest='retroarch_port', type=int)
   parser.add_argument('--route', action='store_true')
   parser.add_argument('--rebuild', action='store_true')
+  parser.add_argument('--tiered-polling', dest='tiered_polling', action='store_true')
+  parser.add_argument('--adaptive-polling', dest='adaptive_polling', action='store_true')
+  parser.add_argument('--reader-process', dest='reader_process', action='store_true')
+  parser.add_argument('--history-server', dest='history_server', nargs='?', const=default_socket_path())
+  parser.add_argument('--keep-attempts', dest='keep_attempts', type=int)
+  parser.add_argument('--keep-days', dest='keep_days', type=float)
+  parser.add_argument('--sketch', dest='sketch_k', type=int)
+  parser.add_argument('--histogram', action='store_true')
   args = parser.parse_args()
 
   rooms = Rooms.read(args.rooms_filename)
@@ -466,10 +772,16 @@ def main():
   frontend = RoomTimerTerminalFrontend(
       verbose=verbose, debug_log=debug_log)
 
-  if args.filename is not None and os.path.exists(args.filename):
-    history = read_transition_log(args.filename, rooms, doors)
-  else:
-    history = History()
+  history = History(
+      retention=retention_policy(args.keep_attempts, args.keep_days),
+      sketch_k=args.sketch_k,
+      histogram=args.histogram)
+
+  if args.history_server is not None:
+    history_client = HistoryClient(args.history_server)
+    history = history_client.read_history(rooms, doors, history)
+  elif args.filename is not None and os.path.exists(args.filename):
+    history = read_transition_log(args.filename, rooms, doors, history)
 
   for tid in history:
     route.record(tid)
@@ -477,15 +789,29 @@ def main():
 
   print('Route is %s' % ('complete' if route.complete else 'incomplete'))
 
-  transition_log = FileTransitionLog(args.filename) if args.filename is not None else NullTransitionLog()
+  if args.history_server is not None:
+    transition_log = history_client
+  elif args.filename is not None:
+    transition_log = FileTransitionLog(args.filename)
+  else:
+    transition_log = NullTransitionLog()
 
   tracker = RoomTimeTracker(
       history, transition_log, route,
       on_new_room_time=frontend.new_room_time)
 
-  state_reader = ThreadedStateReader(
-      rooms, doors,
-      client_type=args.client_type, logger=frontend)
+  if args.reader_process:
+    state_reader = SubprocessStateReader(
+        rooms, doors,
+        client_type=args.client_type, logger=frontend,
+        port=args.retroarch_port)
+  else:
+    state_reader = ThreadedStateReader(
+        rooms, doors,
+        client_type=args.client_type, logger=frontend,
+        tiered=args.tiered_polling,
+        adaptive=args.adaptive_polling,
+        port=args.retroarch_port)
   state_reader.start()
 
   try:
@@ -500,6 +826,8 @@ def main():
 
   finally:
     state_reader.stop()
+    if args.verbose:
+      print(state_reader.metrics)
 
 if __name__ == '__main__':
   main()
@@ -1,13 +1,14 @@
 #!/usr/bin/env python3
 
-from sm_room_timer import RoomTimeTracker, RoomTimer, ThreadedStateReader, backup_and_rebuild, color_for_time
+from sm_room_timer import RoomTimeTracker, RoomTimer, ThreadedStateReader, SubprocessStateReader, backup_and_rebuild, color_for_time
 from rooms import Rooms, NullRoom
 from doors import Doors, NullDoor
 from route import Route, DummyRoute
 from frame_count import FrameCount
 from transition import TransitionTime
 from transition_log import read_transition_log, FileTransitionLog, NullTransitionLog
-from history import Attempts, History
+from history import Attempts, History, retention_policy
+from history_client import HistoryClient, default_socket_path
 from segment import Segment
 from table import Cell, Table
 from rebuild_history import need_rebuild, rebuild_history
@@ -23,9 +24,10 @@ class SegmentTime(TransitionTime):
   pass
 
 class SegmentAttempt(object):
-  def __init__(self, transitions=None):
+  def __init__(self, transitions=None, start_index=None):
     self.segment = Segment()
     self.transitions = transitions or [ ]
+    self.start_index = start_index
     self.time = SegmentTime(
         gametime=FrameCount(0),
         realtime=FrameCount(0),
@@ -34,6 +36,10 @@ class SegmentAttempt(object):
         realtime_door=FrameCount(0),
         doortime_is_real=True)
 
+  @property
+  def ts_us(self):
+    return self.transitions[0].ts_us
+
   def __repr__(self):
     return 'SegmentAttempt(%s)' % repr(self.transitions)
 
@@ -49,26 +55,30 @@ class SegmentAttempt(object):
     self.time += transition.time
 
 class SegmentAttempts(Attempts):
-  def __init__(self, transitions=None):
-    Attempts.__init__(self, transitions)
+  def __init__(self, transitions=None, **kwargs):
+    Attempts.__init__(self, transitions, **kwargs)
 
   def __repr__(self):
     return 'SegmentAttempts(%s)' % repr(self.attempts)
 
 def find_segment_in_history(segment, history):
-  attempts = SegmentAttempts()
+  attempts = history.new_attempts(SegmentAttempts)
   attempt = None
   segment_iter = None
   next_tid = None
 
   for segment_start_idx in history.indexes_by_tid.get(segment.start, []):
-    attempt = SegmentAttempt()
+    attempt = SegmentAttempt(start_index=segment_start_idx)
     segment_iter = iter(segment)
     next_tid = next(segment_iter, None)
 
     for idx in range(segment_start_idx, len(history.all_transitions)):
       transition = history.all_transitions[idx]
 
+      if transition is None:
+        # Discarded by the history's retention policy
+        break
+
       if next_tid is not None and transition.id == next_tid:
         # This is the next transition in the segment
         attempt.append(transition)
@@ -101,11 +111,12 @@ class SegmentTransitionAttemptStats(object):
 
     if attempts is not None:
       self.attempts = attempts
+      summary = attempts.totalrealtimes.summarize()
       self.num_attempts = len(attempts)
-      self.totalrealtime_p75 = attempts.totalrealtimes.percentile(75)
-      self.totalrealtime_p50 = attempts.totalrealtimes.median()
-      self.totalrealtime_p25 = attempts.totalrealtimes.percentile(25)
-      self.totalrealtime_p0 = attempts.totalrealtimes.best()
+      self.totalrealtime_p75 = summary.p75
+      self.totalrealtime_p50 = summary.p50
+      self.totalrealtime_p25 = summary.p25
+      self.totalrealtime_p0 = summary.best
     else:
       self.attempts = Attempts()
       self.num_attempts = 0
@@ -128,6 +139,7 @@ class SegmentAttemptStats(object):
   totalrealtime_p50: FrameCount
   totalrealtime_p25: FrameCount
   totalrealtime_p0: FrameCount
+  totalrealtime_recent_p50: FrameCount
 
   def __init__(self, history):
     self.history = history
@@ -138,6 +150,7 @@ class SegmentAttemptStats(object):
     self.totalrealtime_p50 = None
     self.totalrealtime_p25 = None
     self.totalrealtime_p0 = None
+    self.totalrealtime_recent_p50 = None
 
   def append(self, transition, current_attempt):
     self.transition_stats.append(
@@ -148,11 +161,16 @@ class SegmentAttemptStats(object):
 
     historical_times = self.seg_attempts.totalrealtimes
 
+    summary = historical_times.summarize()
     self.num_attempts = len(self.seg_attempts)
-    self.totalrealtime_p75 = historical_times.percentile(75) if len(historical_times.values()) > 0 else FrameCount(0)
-    self.totalrealtime_p50 = historical_times.median() if len(historical_times.values()) > 0 else FrameCount(0)
-    self.totalrealtime_p25 = historical_times.percentile(25) if len(historical_times.values()) > 0 else FrameCount(0)
-    self.totalrealtime_p0 = historical_times.best() if len(historical_times.values()) > 0 else FrameCount(0)
+    self.totalrealtime_p75 = summary.p75 if summary.n > 0 else FrameCount(0)
+    self.totalrealtime_p50 = summary.p50 if summary.n > 0 else FrameCount(0)
+    self.totalrealtime_p25 = summary.p25 if summary.n > 0 else FrameCount(0)
+    self.totalrealtime_p0 = summary.best if summary.n > 0 else FrameCount(0)
+
+    recent = self.seg_attempts.recent()
+    if recent is not None and len(recent) > 0:
+      self.totalrealtime_recent_p50 = recent.totalrealtimes.median()
 
 class SegmentTimeTracker(RoomTimeTracker):
   def __init__(self, history, transition_log, route,
@@ -311,8 +329,17 @@ def main():
   client_type_group = parser.add_mutually_exclusive_group(required=True)
   client_type_group.add_argument('--usb2snes', dest='client_type', action='store_const', const='usb2snes')
   client_type_group.add_argument('--retroarch', dest='client_type', action='store_const', const='retroarch')
+  parser.add_argument('--retroarch-port', dest='retroarch_port', type=int)
   parser.add_argument('--route', action='store_true')
   parser.add_argument('--rebuild', action='store_true')
+  parser.add_argument('--tiered-polling', dest='tiered_polling', action='store_true')
+  parser.add_argument('--adaptive-polling', dest='adaptive_polling', action='store_true')
+  parser.add_argument('--reader-process', dest='reader_process', action='store_true')
+  parser.add_argument('--history-server', dest='history_server', nargs='?', const=default_socket_path())
+  parser.add_argument('--keep-attempts', dest='keep_attempts', type=int)
+  parser.add_argument('--keep-days', dest='keep_days', type=float)
+  parser.add_argument('--sketch', dest='sketch_k', type=int)
+  parser.add_argument('--histogram', action='store_true')
   # parser.add_argument('--segment', action='append', required=True)
   args = parser.parse_args()
 
@@ -340,10 +367,16 @@ def main():
   frontend = SegmentTimerTerminalFrontend(
       verbose=verbose, debug_log=debug_log)
 
-  if args.filename is not None and os.path.exists(args.filename):
-    history = read_transition_log(args.filename, rooms, doors)
-  else:
-    history = History()
+  history = History(
+      retention=retention_policy(args.keep_attempts, args.keep_days),
+      sketch_k=args.sketch_k,
+      histogram=args.histogram)
+
+  if args.history_server is not None:
+    history_client = HistoryClient(args.history_server)
+    history = history_client.read_history(rooms, doors, history)
+  elif args.filename is not None and os.path.exists(args.filename):
+    history = read_transition_log(args.filename, rooms, doors, history)
 
   for tid in history:
     route.record(tid)
@@ -351,15 +384,29 @@ def main():
 
   print('Route is %s' % ('complete' if route.complete else 'incomplete'))
 
-  transition_log = FileTransitionLog(args.filename) if args.filename is not None else NullTransitionLog()
+  if args.history_server is not None:
+    transition_log = history_client
+  elif args.filename is not None:
+    transition_log = FileTransitionLog(args.filename)
+  else:
+    transition_log = NullTransitionLog()
 
   tracker = SegmentTimeTracker(
       history, transition_log, route,
       on_new_room_time=frontend.new_room_time)
 
-  state_reader = ThreadedStateReader(
-      rooms, doors,
-      client_type=args.client_type, logger=frontend)
+  if args.reader_process:
+    state_reader = SubprocessStateReader(
+        rooms, doors,
+        client_type=args.client_type, logger=frontend,
+        port=args.retroarch_port)
+  else:
+    state_reader = ThreadedStateReader(
+        rooms, doors,
+        client_type=args.client_type, logger=frontend,
+        tiered=args.tiered_polling,
+        adaptive=args.adaptive_polling,
+        port=args.retroarch_port)
   state_reader.start()
 
   try:
@@ -374,6 +421,8 @@ def main():
 
   finally:
     state_reader.stop()
+    if args.verbose:
+      print(state_reader.metrics)
 
 if __name__ == '__main__':
   main()
@@ -0,0 +1,84 @@
+from multiprocessing import shared_memory
+import struct
+
+class SnapshotRing(object):
+  """
+  A ring of fixed-size, timestamped raw memory snapshots in shared
+  memory, written by one process and read by another.
+
+  Each slot is guarded by its own sequence number (a seqlock): the
+  writer makes it odd before touching the slot and even once the slot is
+  complete, and a reader discards any copy taken while the sequence
+  number was odd or changed underneath it.  The writer never waits for
+  the reader; a reader that falls more than a ring behind loses the
+  oldest snapshots.
+  """
+
+  # Number of snapshots written so far
+  HEADER = struct.Struct('<Q')
+
+  SEQ = struct.Struct('<Q')
+  SLOT_HEADER = struct.Struct('<QdI') # seq, timestamp, flags
+
+  def __init__(self, snapshot_size, slots=256, name=None, create=False):
+    self.snapshot_size = snapshot_size
+    self.slots = slots
+    self.slot_size = self.SLOT_HEADER.size + snapshot_size
+    size = self.HEADER.size + slots * self.slot_size
+
+    if create:
+      self.shm = shared_memory.SharedMemory(create=True, size=size)
+      self.shm.buf[0:size] = bytes(size)
+    else:
+      self.shm = shared_memory.SharedMemory(name=name)
+
+    self.name = self.shm.name
+    self.buf = self.shm.buf
+    self.num_written = self.written
+
+  def close(self):
+    self.buf = None
+    self.shm.close()
+
+  def unlink(self):
+    self.shm.unlink()
+
+  @property
+  def written(self):
+    return self.HEADER.unpack_from(self.buf, 0)[0]
+
+  def _slot_offset(self, n):
+    return self.HEADER.size + (n % self.slots) * self.slot_size
+
+  def write(self, snapshot, timestamp, flags=0):
+    n = self.num_written
+    offset = self._slot_offset(n)
+    data_offset = offset + self.SLOT_HEADER.size
+
+    self.SLOT_HEADER.pack_into(self.buf, offset, 2 * n + 1, timestamp, flags)
+    self.buf[data_offset:data_offset+self.snapshot_size] = snapshot
+    self.SEQ.pack_into(self.buf, offset, 2 * n + 2)
+
+    self.num_written = n + 1
+    self.HEADER.pack_into(self.buf, 0, self.num_written)
+
+  def read(self, n):
+    """
+    Returns (timestamp, flags, snapshot) for the nth snapshot, or None if
+    it has not been written yet or has already been overwritten.
+    """
+    offset = self._slot_offset(n)
+    data_offset = offset + self.SLOT_HEADER.size
+    expected = 2 * n + 2
+
+    seq, timestamp, flags = self.SLOT_HEADER.unpack_from(self.buf, offset)
+    if seq != expected:
+      return None
+
+    snapshot = bytes(self.buf[data_offset:data_offset+self.snapshot_size])
+
+    seq, = self.SEQ.unpack_from(self.buf, offset)
+    if seq != expected:
+      return None
+
+    return timestamp, flags, snapshot
@@ -30,6 +30,7 @@ def segment_from_name(name, rooms, route):
 
 def segments_from_splits(route, splits):
   segments = [ ]
+  splits = set(splits)
   if len(route) > 0:
     start_split = False
     segment_start = route[0]
@@ -42,6 +43,13 @@ def segments_from_splits(route, splits):
         start_split = True
   return segments
 
+def index_segments_by_transition(segments):
+  index = { }
+  for segment in segments:
+    for tid in segment:
+      index.setdefault(tid, [ ]).append(segment)
+  return index
+
 def read_split_names_from_file(filename):
   with open(filename) as f:
     lines = [ line for line in f.readlines()
@@ -4,6 +4,8 @@ from rooms import NullRoom
 from doors import NullDoor
 from game_states import GameStates
 
+from typing import NamedTuple
+
 def items_string(imask):
   a = [
     's' if (imask & 0x2000) else '.', # speed
@@ -51,6 +53,45 @@ ram_seg_rt_seconds = WRAM_START + 0x16
 ram_seg_rt_minutes = WRAM_START + 0x18
 ram_reset_segment_later = WRAM_START + 0x1A
 
+# The smallest set of addresses that tells us whether anything we care
+# about might have changed: the game state, the room id, and the IGT
+SENTINEL_ADDRESSES = [
+  (0x0998, 0x02), # game state
+  (0x079B, 0x02), # room id
+  (0x09DA, 0x07), # 0x9DA to 0x9E0 (IGT)
+]
+
+STATE_ADDRESSES = [
+  (0x078D, 0x10), # 0x78D to 0x79C
+  (0x0998, 0x02), # 0x998 to 0x999
+  (0x09A4, 0x06), # 0x9A4 to 0x9A9
+  (0x09DA, 0x07), # 0x9DA to 0x9E0
+  (WRAM_START, 0x20), # 0xFD00 to 0xFD19
+]
+
+# Only read at the landing site
+SHIP_STATE_ADDRESSES = [
+  (0xD821, 0x01),
+  (0x0FB2, 0x02),
+]
+
+class Sentinel(NamedTuple):
+  game_state_id: int
+  room_id: int
+  igt: int
+
+  @staticmethod
+  def read_from(sock):
+    mem = SparseMemory.read_from(sock, *SENTINEL_ADDRESSES)
+    if mem is None:
+      return None
+
+    igt = 216000 * mem[0x9E0] + 3600 * mem[0x9DE] + 60 * mem[0x9DC] + mem.short(0x9DA)
+    return Sentinel(
+        game_state_id=mem.short(0x998),
+        room_id=mem.short(0x79B),
+        igt=igt)
+
 class State(object):
   def __init__(self, **attrs):
     for name in attrs:
@@ -61,25 +102,22 @@ class State(object):
       self.__dict__.items() ])
 
   @staticmethod
-  def read_from(sock, rooms, doors, read_ship_state=False):
-    addresses = [
-      (0x078D, 0x10), # 0x78D to 0x79C
-      (0x0998, 0x02), # 0x998 to 0x999
-      (0x09A4, 0x06), # 0x9A4 to 0x9A9
-      (0x09DA, 0x07), # 0x9DA to 0x9E0
-      (WRAM_START, 0x20), # 0xFD00 to 0xFD19
-    ]
-
+  def addresses(read_ship_state=False):
     if read_ship_state:
-      addresses.extend([
-        (0xD821, 0x01),
-        (0x0FB2, 0x02),
-      ])
+      return STATE_ADDRESSES + SHIP_STATE_ADDRESSES
+    else:
+      return STATE_ADDRESSES
 
-    mem = SparseMemory.read_from(sock, *addresses)
+  @staticmethod
+  def read_from(sock, rooms, doors, read_ship_state=False):
+    mem = SparseMemory.read_from(sock, *State.addresses(read_ship_state))
     if mem is None:
       return None
 
+    return State.decode(mem, rooms, doors, read_ship_state)
+
+  @staticmethod
+  def decode(mem, rooms, doors, read_ship_state=False):
     door_id = mem.short(0x78D)
     room_id = mem.short(0x79B)
     door = doors.from_id(door_id)
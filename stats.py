@@ -4,6 +4,8 @@ from frame_count import FrameCount
 from rooms import Room, Rooms, NullRoom
 from doors import Doors, NullDoor
 from transition_log import read_transition_log
+from history import History, retention_policy
+from frame_count_list import score_at_percentile
 from route import build_route, is_ceres_escape
 from transition import Transition
 from table import Cell, Table
@@ -11,6 +13,7 @@ from table import Cell, Table
 from scipy import stats
 from typing import NamedTuple
 import argparse
+import bisect
 
 class TransitionStats(NamedTuple):
   room: str
@@ -29,11 +32,11 @@ class TransitionStats(NamedTuple):
 def transition_stats(id, attempts, iqr, exclude_doors, doors_only):
   n = len(attempts.attempts)
 
-  values = [ ]
-  if not doors_only: values.append(attempts.realtimes.values())
-  if not exclude_doors: values.append(attempts.doorlagtimes.values())
+  columns = [ ]
+  if not doors_only: columns.append('realtimes')
+  if not exclude_doors: columns.append('doorlagtimes')
 
-  times = [ sum(v) for v in zip(*values) ]
+  times = attempts.column_sum(*columns)
 
   best = FrameCount(stats.scoreatpercentile(times, 0))
   p25 = FrameCount(stats.scoreatpercentile(times, 25))
@@ -49,6 +52,47 @@ def transition_stats(id, attempts, iqr, exclude_doors, doors_only):
       p75=p75, p90=p90, save=save, most_recent=most_recent,
       save_most_recent=save_most_recent, items=items, beams=beams)
 
+class RunningTransitionStats(object):
+  """
+  Keeps the times for a transition in sorted order as attempts are
+  added, so the same stats as transition_stats can be produced without
+  re-sorting all the attempts each time.  Each insert is still O(n) (it
+  shifts the list), which is fine for the number of attempts a single
+  transition gets.
+  """
+
+  def __init__(self, id, iqr, exclude_doors, doors_only):
+    self.id = id
+    self.iqr = iqr
+    self.exclude_doors = exclude_doors
+    self.doors_only = doors_only
+    self.n = 0
+    self.times = [ ]
+    self.most_recent = None
+
+  def append(self, transition):
+    self.n += 1
+
+    values = [ ]
+    if not self.doors_only: values.append(transition.time.realtime.count)
+    if not self.exclude_doors: values.append(transition.time.doorlag.count)
+    if len(values) > 0: bisect.insort(self.times, sum(values))
+
+    self.most_recent = transition.time.realtime + transition.time.doorlag
+
+  def stats(self):
+    best = FrameCount(self.times[0])
+    p25 = FrameCount(score_at_percentile(self.times, 25))
+    p50 = FrameCount(score_at_percentile(self.times, 50))
+    p75 = FrameCount(score_at_percentile(self.times, 75))
+    p90 = FrameCount(score_at_percentile(self.times, 90))
+    save = p75 - p25 if self.iqr else p50 - best
+    save_most_recent = max(self.most_recent - p50, FrameCount(0))
+    return TransitionStats(room=self.id.room, n=self.n, best=best,
+        p25=p25, p50=p50, p75=p75, p90=p90, save=save,
+        most_recent=self.most_recent, save_most_recent=save_most_recent,
+        items=self.id.items, beams=self.id.beams)
+
 def ceres_cutscene_stats(id, attempts, iqr):
   n = len(attempts.attempts)
   best = FrameCount(2951)
@@ -86,7 +130,38 @@ def door_stats(num_rooms, iqr):
       most_recent=most_recent, save_most_recent=save_most_recent,
       items='', beams='')
 
+def compute_transition_stats(history, ids, start_room, end_room, iqr,
+    exclude_doors, doors_only):
+  printing = False if start_room else True
+
+  all_stats = [ ]
+  num_rooms = 0
+  for id in ids:
+    if start_room == id.room.name: printing = True
+    if end_room == id.room.name: break
+    if not printing: continue
+
+    num_rooms += 1
+
+    # TODO: We should keep stats for real+door, rather than keeping
+    # those separately
+    attempts = history[id]
+
+    all_stats.append(transition_stats(id, attempts, iqr=iqr,
+      exclude_doors=exclude_doors, doors_only=doors_only))
+
+    if is_ceres_escape(id) and not doors_only:
+      all_stats.append(ceres_cutscene_stats(id, attempts, iqr))
+
+  if not exclude_doors:
+    all_stats.append(door_stats(num_rooms, iqr))
+
+  return all_stats
+
 if __name__ == '__main__':
+  # Imported here because history_client imports this module
+  from history_client import HistoryClient, default_socket_path
+
   parser = argparse.ArgumentParser(description='SM Room Timer')
   parser.add_argument('-f', '--file', dest='filename', default=None)
   parser.add_argument('--rooms', dest='rooms_filename', default='rooms.json')
@@ -100,36 +175,30 @@ if __name__ == '__main__':
   parser.add_argument('--most-recent', action='store_true')
   parser.add_argument('--exclude-doors', action='store_true')
   parser.add_argument('--doors-only', action='store_true')
+  parser.add_argument('--history-server', dest='history_server', nargs='?', const=default_socket_path(), default=None)
+  parser.add_argument('--last', dest='last_attempts', type=int)
+  parser.add_argument('--days', dest='last_days', type=float)
   args = parser.parse_args()
 
-  rooms = Rooms.read(args.rooms_filename)
-  doors = Doors.read(args.doors_filename, rooms)
-  history = read_transition_log(args.filename, rooms, doors)
-
-  ids = build_route(history) if args.build_route else history.keys()
-  printing = False if args.start_room else True
-
-  all_stats = [ ]
-  num_rooms = 0
-  for id in ids:
-    if args.start_room == id.room.name: printing = True
-    if args.end_room == id.room.name: break
-    if not printing: continue
-
-    num_rooms += 1
-
-    # TODO: We should keep stats for real+door, rather than keeping
-    # those separately
-    attempts = history[id]
-
-    all_stats.append(transition_stats(id, attempts, iqr=args.iqr,
-      exclude_doors=args.exclude_doors, doors_only=args.doors_only))
+  if args.history_server is not None:
+    client = HistoryClient(args.history_server)
+    all_stats = client.transition_stats(route=args.build_route,
+        start_room=args.start_room, end_room=args.end_room, iqr=args.iqr,
+        exclude_doors=args.exclude_doors, doors_only=args.doors_only)
+    client.close()
 
-    if is_ceres_escape(id) and not args.doors_only:
-      all_stats.append(ceres_cutscene_stats(id, attempts, args.iqr))
+  else:
+    rooms = Rooms.read(args.rooms_filename)
+    doors = Doors.read(args.doors_filename, rooms)
+    # Only the most recent attempts are kept in memory if --last or
+    # --days is given
+    history = read_transition_log(args.filename, rooms, doors, History(
+        retention=retention_policy(args.last_attempts, args.last_days)))
 
-  if not args.exclude_doors:
-    all_stats.append(door_stats(num_rooms, args.iqr))
+    ids = build_route(history) if args.build_route else history.keys()
+    all_stats = compute_transition_stats(history, ids,
+        start_room=args.start_room, end_room=args.end_room, iqr=args.iqr,
+        exclude_doors=args.exclude_doors, doors_only=args.doors_only)
 
   saves = [ s.save.count for s in all_stats ]
   p75_save = FrameCount(stats.scoreatpercentile(saves, 75))
@@ -0,0 +1,35 @@
+import os
+import subprocess
+import sys
+import unittest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_DIR = os.path.join(REPO_DIR, 'tests', 'data')
+
+class ProgressionTest(unittest.TestCase):
+  """
+  Compares the output of progression.py with the output of the version
+  that recomputed every stat for each row.  The logs were picked
+  because some of their route totals fall exactly halfway between two
+  milliseconds.
+  """
+
+  def check_output(self, name, *args):
+    log = os.path.join(DATA_DIR, name + '.csv')
+    with open(os.path.join(DATA_DIR, name + '.txt')) as f:
+      expected = f.read()
+
+    result = subprocess.run(
+        [ sys.executable, 'progression.py', '-f', log, *args ],
+        cwd=REPO_DIR, stdout=subprocess.PIPE, check=True,
+        universal_newlines=True)
+    self.assertEqual(result.stdout.splitlines(), expected.splitlines())
+
+  def test_exclude_doors(self):
+    self.check_output('progression_exclude_doors', '--exclude-doors')
+
+  def test_doors_only(self):
+    self.check_output('progression_doors_only', '--doors-only')
+
+if __name__ == '__main__':
+  unittest.main()
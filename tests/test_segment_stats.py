@@ -0,0 +1,72 @@
+import csv
+import os
+import sys
+import unittest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_DIR = os.path.join(REPO_DIR, 'tests', 'data')
+sys.path.insert(0, REPO_DIR)
+
+from rooms import Rooms
+from doors import Doors
+from transition import Transition
+from history import History, retention_policy
+from route import build_route
+from segment import Segment
+from segment_stats import SplitStatsTracker, SegmentStats
+
+def summarize(stats):
+  return [ (s.segment_attempt_count, s.segment_success_count, s.p50, s.p0,
+    s.sob) for s in stats.segments ]
+
+class SplitStatsTrackerTest(unittest.TestCase):
+  """
+  Checks that the stats kept up to date by a SplitStatsTracker match
+  SegmentStats built from scratch from the same history, including
+  after the history's retention policy has discarded attempts.
+  """
+
+  @classmethod
+  def setUpClass(cls):
+    rooms = Rooms.read(os.path.join(REPO_DIR, 'rooms.json'))
+    doors = Doors.read(os.path.join(REPO_DIR, 'doors.json'), rooms)
+    with open(os.path.join(DATA_DIR, 'progression_exclude_doors.csv')) as f:
+      cls.transitions = [ Transition.from_csv_row(rooms, doors, row)
+          for row in csv.DictReader(f) ]
+
+    history = History()
+    for transition in cls.transitions:
+      history.record(transition, from_file=True)
+    route = build_route(history)
+    cls.segments = [ Segment(route[i:i+n]) for n in (1, 2, 5)
+        for i in range(0, len(route) - n, 3) ]
+
+  def check_retention(self, retention):
+    history = History(retention=retention)
+    start = len(self.transitions) // 3
+    for transition in self.transitions[:start]:
+      history.record(transition, from_file=True)
+
+    # The tracker can only follow segments whose rooms it has seen
+    segments = [ segment for segment in self.segments
+        if all(tid in history for tid in segment) ]
+    tracker = SplitStatsTracker(history, segments)
+
+    for transition in self.transitions[start:]:
+      history.record(transition, from_file=True)
+      self.assertEqual(summarize(tracker.segment_stats()),
+          summarize(SegmentStats(history, segments)))
+
+  def test_no_retention(self):
+    self.check_retention(None)
+
+  def test_keep_attempts(self):
+    for keep in (1, 5, 20):
+      with self.subTest(keep=keep):
+        self.check_retention(retention_policy(max_attempts=keep))
+
+  def test_keep_days(self):
+    self.check_retention(retention_policy(max_days=0.01))
+
+if __name__ == '__main__':
+  unittest.main()
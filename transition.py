@@ -7,6 +7,18 @@ from doors import Door, NullDoor
 import datetime
 from dataclasses import dataclass
 import re
+import threading
+
+# Timestamps are stored as microseconds since the (naive) epoch, so they
+# round-trip exactly to the naive local datetimes written to the csv.
+EPOCH = datetime.datetime(1970, 1, 1)
+ONE_MICROSECOND = datetime.timedelta(microseconds=1)
+
+def timestamp_to_us(ts):
+  return (ts - EPOCH) // ONE_MICROSECOND
+
+def timestamp_from_us(us):
+  return EPOCH + datetime.timedelta(microseconds=us)
 
 @dataclass
 class TransitionId(object):
@@ -15,8 +27,36 @@ class TransitionId(object):
   exit_door: Door
   items: str
   beams: str
+  handle: int
+
+  # Every distinct (room, entry door, exit door, items, beams) maps to a
+  # single canonical TransitionId.  Ids that compare equal (same rooms,
+  # items and beams) share a small integer handle, so hashing and
+  # equality do not need to build tuples or compare strings.
+  _interned = { }
+  _handles = { }
+  _lock = threading.Lock()
+
+  def __new__(cls, room, entry_door, exit_door, items, beams):
+    key = (room, entry_door, exit_door, items, beams)
+    tid = cls._interned.get(key)
+    if tid is not None:
+      return tid
+
+    with cls._lock:
+      tid = cls._interned.get(key)
+      if tid is None:
+        tid = object.__new__(cls)
+        tid._init(room, entry_door, exit_door, items, beams)
+        cls._interned[key] = tid
+
+    return tid
 
   def __init__(self, room, entry_door, exit_door, items, beams):
+    # Initialization happens once, in __new__, when the id is interned
+    pass
+
+  def _init(self, room, entry_door, exit_door, items, beams):
     self.room = room
     self.entry_door = entry_door
     self.exit_door = exit_door
@@ -30,6 +70,17 @@ class TransitionId(object):
       # raise RuntimeError("Expected %s == %s" % (room, exit_door.entry_room))
       raise RuntimeError("Entry room for exit door %s should be %s, not %s" % (exit_door, exit_door.entry_room, room))
 
+    handle_key = (room, self.entry_room, self.exit_room, items, beams)
+    handle = TransitionId._handles.get(handle_key)
+    if handle is None:
+      handle = len(TransitionId._handles)
+      TransitionId._handles[handle_key] = handle
+    self.handle = handle
+
+  def __reduce__(self):
+    return (TransitionId, (self.room, self.entry_door, self.exit_door,
+      self.items, self.beams))
+
   @property
   def entry_room(self):
     return self.entry_door.entry_room
@@ -60,10 +111,14 @@ class TransitionId(object):
       return None
 
   def __hash__(self):
-    return hash((self.room, self.entry_room, self.exit_room, self.items, self.beams))
+    return self.handle
 
   def __eq__(self, other):
-    return self.room is other.room and self.entry_room is other.entry_room and self.exit_room is other.exit_room and self.items == other.items and self.beams == other.beams
+    if self is other:
+      return True
+    if not isinstance(other, TransitionId):
+      return NotImplemented
+    return self.handle == other.handle
 
   def __str__(self):
     return '%s (entering from %s via %x, exiting to %s via %x)' % (
@@ -101,10 +156,19 @@ class TransitionTime(NamedTuple):
     return self.realtime + self.realtime_door
 
 class Transition(NamedTuple):
-  ts: datetime.datetime
+  # The datetime is only needed when displaying history, so we keep the
+  # compact integer form and build the datetime on demand.
+  ts_us: int
   id: TransitionId
   time: TransitionTime
 
+  @property
+  def ts(self):
+    return timestamp_from_us(self.ts_us)
+
+  def isoformat(self):
+    return self.ts.isoformat()
+
   def __repr__(self):
       return "Transition(%s,%s,%s,%s,%s,%s)" % (
         self.id, self.time.gametime,
@@ -121,7 +185,7 @@ class Transition(NamedTuple):
 
   def as_csv_row(self):
     return (
-      self.ts.isoformat(),
+      self.isoformat(),
       '%04x' % self.id.room.room_id,
       '%04x' % self.id.entry_room.room_id,
       '%04x' % self.id.exit_room.room_id,
@@ -158,9 +222,9 @@ class Transition(NamedTuple):
 
     ts = row.get('timestamp', None)
     if ts is not None:
-      ts = datetime.datetime.fromisoformat(ts)
+      ts = timestamp_to_us(datetime.datetime.fromisoformat(ts))
     else:
-      ts = datetime.datetime.fromtimestamp(0)
+      ts = timestamp_to_us(datetime.datetime.fromtimestamp(0))
 
     doorlag_seconds = row.get('doorlagtime', None) or row['doortime']
     doorlagtime = FrameCount.from_seconds(float(doorlag_seconds))
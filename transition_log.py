@@ -30,8 +30,8 @@ class NullTransitionLog(object):
   def close(self):
     pass
 
-def read_transition_log_csv_incrementally(csvfile, rooms, doors):
-  history = History()
+def read_transition_log_csv_incrementally(csvfile, rooms, doors, history=None):
+  history = history if history is not None else History()
   reader = csv.DictReader(csvfile)
   n = 1 # start at 1 for the header
   for row in reader:
@@ -46,14 +46,14 @@ def read_transition_log_csv_incrementally(csvfile, rooms, doors):
       raise RuntimeError("Error %s, line %d\nrow: %s" % (action, n, row)) from e
   return history
 
-def read_transition_log_incrementally(filename, rooms, doors):
+def read_transition_log_incrementally(filename, rooms, doors, history=None):
   with open(filename) as csvfile:
-    for history, transition in read_transition_log_csv_incrementally(csvfile, rooms, doors):
+    for history, transition in read_transition_log_csv_incrementally(csvfile, rooms, doors, history):
       yield history, transition
 
-def read_transition_log(filename, rooms, doors):
-  history = History()
-  for h, transition in read_transition_log_incrementally(filename, rooms, doors):
+def read_transition_log(filename, rooms, doors, history=None):
+  history = history if history is not None else History()
+  for h, transition in read_transition_log_incrementally(filename, rooms, doors, history):
     history = h
   print("Read history for {} rooms.".format(len(history)))
   return history
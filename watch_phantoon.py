@@ -8,6 +8,7 @@ from state import State
 from rooms import Rooms
 from doors import Doors
 from memory import SparseMemory
+from sm_room_timer import ThreadedStateReader, wait_until
 
 import argparse
 import time
@@ -15,6 +16,8 @@ import sys
 
 WRAM_START = 0x7EFD00 - 0x7E0000
 
+PHANTOON_ROOM_ID = 0xCD13
+
 def format_time(frames):
   return "%s'%02d" % (frames // 60, frames % 60)
 
@@ -27,9 +30,15 @@ class PhantoonState(object):
     return "PhantoonState(%s)" % ', '.join([ '%s=%s' % (k,repr(v)) for k,v in
       self.__dict__.items() ])
 
+  @staticmethod
+  def read_room_id(sock):
+    mem = SparseMemory.read_from(sock, (0x079b, 0x2))
+    return mem.short(0x079b) if mem is not None else None
+
   @staticmethod
   def read_from(sock):
     addresses = (
+        (0x079b, 0x2),       # room id
         (0x09c6, 0x0e),      # 0x9c6 to 0x9d3
         (0x0f7a, 0x74),      # 0xf7a to 0xfef
         (0x102a, 0x2),
@@ -41,6 +50,7 @@ class PhantoonState(object):
 
     if mem is None: return None
 
+    room_id = mem.short(0x079b)
     volley_damage = mem.short(0x102a)
     timer = mem.short(0x0fb0)
     state = mem.short(0x0fb2)
@@ -61,6 +71,7 @@ class PhantoonState(object):
     shot_timer = mem.short(WRAM_START + 0x58)
 
     return PhantoonState(
+        room_id=room_id,
         volley_damage=volley_damage,
         timer=timer,
         state=state,
@@ -93,6 +104,13 @@ class PhantoonRound(object):
     self.side = self._side_from_state(state)
     self.speed = self._speed_from_state(state)
     self.eye_close_speed = None
+    self.missed_eye_close = False
+
+    # Filled in when the round ends
+    self.damage = 0
+    self.volleys = [ ]
+    self.doppler_timings = [ ]
+    self.doppler_hit_timings = [ ]
 
   def _side_from_state(self, state):
     if self.round_num == 1 and self.sub_round_num == 0:
@@ -121,6 +139,7 @@ class PhantoonFight(object):
     self.round_num = 0
     self.sub_round_num = 0
     self.round = None
+    self.rounds = [ ]
 
     self.round_count = 0
     self.sub_round_count = 0
@@ -191,6 +210,14 @@ class PhantoonFight(object):
 
     self.last_round_damage = self.round_start_hit_points - state.hit_points
 
+    self.round.missed_eye_close = self.missed_eye_close
+    self.round.damage = self.last_round_damage
+    self.round.volleys = list(self.volleys)
+    self.round.doppler_timings = list(self.doppler_timings)
+    self.round.doppler_hit_timings = list(self.doppler_hit_timings)
+    if not self.rounds or self.rounds[-1] is not self.round:
+      self.rounds.append(self.round)
+
   def fight_ended(self, state):
     self.fight_time = state.realtime_room + 726 # 1024 if called from state d948
 
@@ -246,10 +273,12 @@ class PhantoonFight(object):
       )
 
 class PhantoonWatcher(object):
-  def __init__(self, sock):
+  def __init__(self, sock, on_fight_ended=lambda fight: None):
     self.sock = sock
+    self.on_fight_ended = on_fight_ended
 
     self.prev_state = None
+    self.in_phantoon_room = False
     self.reset()
 
   def reset(self):
@@ -307,11 +336,28 @@ class PhantoonWatcher(object):
 
     return False
 
+  def poll_interval(self):
+    if self.in_phantoon_room:
+      return ThreadedStateReader.NORMAL_INTERVAL
+    else:
+      return ThreadedStateReader.IDLE_INTERVAL
+
   def poll(self):
-    state = PhantoonState.read_from(sock)
+    # Only read the enemy block while we are in Phantoon's room;
+    # everywhere else, all we need to know is when we enter it
+    if not self.in_phantoon_room:
+      room_id = PhantoonState.read_room_id(self.sock)
+      self.in_phantoon_room = (room_id == PHANTOON_ROOM_ID)
+      return
+
+    state = PhantoonState.read_from(self.sock)
 
     if state is None: return
 
+    if state.room_id != PHANTOON_ROOM_ID:
+      self.in_phantoon_room = False
+      return
+
     if self.prev_state is None or state.state != self.prev_state.state:
       if self.last_transition_time is not None:
         s = '(%s)' % (state.realtime_room - self.last_transition_time)
@@ -330,6 +376,7 @@ class PhantoonWatcher(object):
       self.fight.fight_ended(state)
       self.report_fight_summary()
       self.reported_fight_summary = True
+      self.on_fight_ended(self.fight)
 
     # d408 - initial fireball spin
     if self.prev_state is not None and self.prev_state.state == 0xd508 and state.state != 0xd508:
@@ -388,16 +435,99 @@ class PhantoonWatcher(object):
 
     self.prev_state = state
 
+def print_fight_stats(log):
+  import numpy as np
+  from phantoon_log import SIDES, SPEEDS, DOPPLER_SHOT, DOPPLER_HIT
+
+  fights, rounds, values = log
+
+  if len(fights) == 0:
+    print('No fights logged')
+    return
+
+  def print_counts(title, a, label=str):
+    print(title)
+    keys, counts = np.unique(a, return_counts=True)
+    for key, count in zip(keys.tolist(), counts.tolist()):
+      print('  %-16s %5d (%4.1f%%)' % (label(key), count, 100.0 * count / len(a)))
+
+  def print_histogram(title, a, max_bins=20, width=40):
+    print(title)
+    if len(a) == 0:
+      print('  (none)')
+      return
+    lo, hi = int(a.min()), int(a.max()) + 1
+    bin_width = -(-(hi - lo) // max_bins)
+    bins = np.arange(lo, hi + bin_width, bin_width)
+    counts, edges = np.histogram(a, bins=bins)
+    scale = width / counts.max()
+    for start, end, count in zip(edges[:-1].tolist(), edges[1:].tolist(), counts.tolist()):
+      label = '%d' % start if end - start == 1 else '%d-%d' % (start, end - 1)
+      print('  %-9s %5d %s' % (label, count, '#' * int(np.ceil(count * scale))))
+
+  print('%d fights' % len(fights))
+  print()
+
+  percentiles = np.percentile(fights['fight_time'], (0, 25, 50, 75, 90))
+  print('Fight time:')
+  for p, t in zip(('best', 'p25', 'p50', 'p75', 'p90'), percentiles):
+    print('  %-16s %s' % (p, format_time(int(round(t)))))
+  print()
+
+  print_counts('Rounds:', fights['rounds'].astype(np.int64) * 100 + fights['sub_rounds'],
+      label=lambda n: '%d+%d' % (n // 100, n % 100) if n % 100 else '%d' % (n // 100))
+  print()
+
+  full_rounds = rounds[rounds['sub_round'] == 0]
+  first_rounds = full_rounds[full_rounds['round'] == 1]
+  pattern = lambda n: '%s %s' % (SIDES[n // 4], SPEEDS[n % 4])
+  print_counts('Round one patterns:', first_rounds['side'] * 4 + first_rounds['speed'], label=pattern)
+  print()
+
+  print_counts('All patterns:', full_rounds['side'] * 4 + full_rounds['speed'], label=pattern)
+  print()
+
+  eye_close = rounds[rounds['eye_close_speed'] > 0]
+  print_counts('Eye close speeds:', eye_close['eye_close_speed'], label=lambda n: SPEEDS[n])
+  print()
+
+  print_histogram('Doppler shot timings:', values[values['kind'] == DOPPLER_SHOT]['value'])
+  print()
+
+  print_histogram('Doppler hit timings:', values[values['kind'] == DOPPLER_HIT]['value'])
+
 if __name__ == '__main__':
   parser = argparse.ArgumentParser(description='Watch phantoon')
+  parser.add_argument('--port', dest='port', type=int)
+  parser.add_argument('--log', dest='log_filename')
+  parser.add_argument('--stats', action='store_true')
   args = parser.parse_args()
 
-  sock = NetworkCommandSocket()
-  watcher = PhantoonWatcher(sock)
+  if args.stats:
+    if args.log_filename is None:
+      print('--stats requires --log')
+      sys.exit(1)
+    from phantoon_log import read_fight_log
+    print_fight_stats(read_fight_log(args.log_filename))
+    sys.exit(0)
+
+  # The fight log needs numpy, so only import it if it is used
+  if args.log_filename is not None:
+    from phantoon_log import PhantoonFightLog
+    log = PhantoonFightLog(args.log_filename)
+    on_fight_ended = lambda fight: log.write_fight(fight, time.time())
+  else:
+    on_fight_ended = lambda fight: None
+
+  sock = NetworkCommandSocket(port=args.port)
+  watcher = PhantoonWatcher(sock, on_fight_ended=on_fight_ended)
 
   print()
   print('GRAB SOME POPCORN, THIS IS GOING TO BE A GOOD FIGHT!')
   print()
 
+  deadline = time.monotonic()
+
   while True:
     watcher.poll()
+    deadline = wait_until(deadline + watcher.poll_interval())
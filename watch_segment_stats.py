@@ -2,22 +2,90 @@
 
 from rooms import Room, Rooms, NullRoom
 from doors import Doors, NullDoor
-from history import History
+from history import History, retention_policy
 from transition_log import read_transition_log_csv_incrementally
 from route import build_route, is_ceres_escape
-from segment_stats import SegmentStats
+from segment_stats import SplitStatsTracker
 from splits import Splits, read_split_names_from_file
 from table import Cell, Table, CompactRenderer
 from frame_count import FrameCount
+from history_client import HistoryClient, default_socket_path
 
 import sys
 import argparse
+import ctypes
+import ctypes.util
+import os
+import select
 import time
 
-class Tailer(object):
+class StatWatcher(object):
+  """
+  Waits for a file to grow by polling its size.
+  """
+
   def __init__(self, f, t=0.1):
     self._f = f
     self._t = t
+    self._size = os.fstat(f.fileno()).st_size
+
+  def wait(self):
+    while True:
+      size = os.fstat(self._f.fileno()).st_size
+      if size != self._size:
+        self._size = size
+        return
+      time.sleep(self._t)
+
+  def close(self):
+    pass
+
+class InotifyWatcher(object):
+  """
+  Waits for a file to be modified using inotify (Linux only).
+  """
+
+  IN_MODIFY = 0x00000002
+  IN_NONBLOCK = 0o4000
+  IN_CLOEXEC = 0o2000000
+
+  def __init__(self, f, timeout=1.0):
+    self._timeout = timeout
+    libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+
+    self._fd = libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+    if self._fd < 0:
+      errno = ctypes.get_errno()
+      raise OSError(errno, os.strerror(errno))
+
+    wd = libc.inotify_add_watch(self._fd, os.fsencode(f.name), self.IN_MODIFY)
+    if wd < 0:
+      errno = ctypes.get_errno()
+      os.close(self._fd)
+      raise OSError(errno, os.strerror(errno))
+
+  def wait(self):
+    # The timeout is a safety net in case we somehow miss an event; the
+    # caller just checks the file again.
+    select.select([self._fd], [], [], self._timeout)
+    try:
+      while os.read(self._fd, 4096): pass
+    except BlockingIOError:
+      pass
+
+  def close(self):
+    os.close(self._fd)
+
+def create_watcher(f):
+  try:
+    return InotifyWatcher(f)
+  except (AttributeError, OSError, TypeError):
+    return StatWatcher(f)
+
+class Tailer(object):
+  def __init__(self, f, watcher=None):
+    self._f = f
+    self._watcher = watcher or create_watcher(f)
     self._buf = ''
     self._line = None
 
@@ -44,7 +112,11 @@ class Tailer(object):
       self.step()
       if line is not None:
         return line
-      time.sleep(self._t)
+      if self._line is None:
+        self._watcher.wait()
+
+  def close(self):
+    self._watcher.close()
 
 def render_change(old, new, **kwargs):
   if new < old:
@@ -98,6 +170,31 @@ def render_segment_stats(old_stats, stats):
 
   return table.render()
 
+def watch_segment_stats(stats_iter):
+  old_stats = next(stats_iter)
+  old_rendered_stats = None
+
+  for stats in stats_iter:
+    rendered_stats = render_segment_stats(old_stats, stats)
+    if rendered_stats != old_rendered_stats:
+      print()
+      print()
+      print(rendered_stats, end='', flush=True)
+      old_rendered_stats = rendered_stats
+    old_stats = stats
+
+def local_segment_stats(history_reader, split_stats):
+  yield split_stats.segment_stats()
+  while True:
+    yield split_stats.segment_stats()
+    next(history_reader)
+
+def remote_segment_stats(history_client, follower):
+  yield history_client.segment_stats()
+  while True:
+    yield history_client.segment_stats()
+    next(follower)
+
 def main():
   parser = argparse.ArgumentParser(description='SM Room Timer')
   parser.add_argument('-f', '--file', dest='filename', default=None)
@@ -106,14 +203,26 @@ def main():
   parser.add_argument('--segment', dest='segments', action='append', default=[])
   parser.add_argument('--split', dest='splits', action='append', default=[])
   parser.add_argument('--splits', dest='splits_filename')
+  parser.add_argument('--history-server', dest='history_server', nargs='?', const=default_socket_path(), default=None)
+  parser.add_argument('--keep-attempts', dest='keep_attempts', type=int)
+  parser.add_argument('--keep-days', dest='keep_days', type=float)
   args = parser.parse_args()
 
+  if args.history_server is not None:
+    # The server decides which splits to track
+    history_client = HistoryClient(args.history_server)
+    follower = HistoryClient(args.history_server).follow()
+    watch_segment_stats(remote_segment_stats(history_client, follower))
+    return
+
   rooms = Rooms.read(args.rooms_filename)
   doors = Doors.read(args.doors_filename, rooms)
 
   with open(args.filename) as csvfile:
     tailer = Tailer(csvfile)
-    history_reader = read_transition_log_csv_incrementally(tailer, rooms, doors)
+    history = History(
+        retention=retention_policy(args.keep_attempts, args.keep_days))
+    history_reader = read_transition_log_csv_incrementally(tailer, rooms, doors, history)
 
     while not tailer.at_eof():
       history, transition = next(history_reader)
@@ -132,19 +241,10 @@ def main():
         rooms,
         route)
 
-    old_stats = SegmentStats(history, split_segments)
-    old_rendered_stats = None
-
-    while True:
-      stats = SegmentStats(history, split_segments)
-      rendered_stats = render_segment_stats(old_stats, stats)
-      if rendered_stats != old_rendered_stats:
-        print()
-        print()
-        print(rendered_stats, end='', flush=True)
-        old_rendered_stats = rendered_stats
-      old_stats = stats
-      history, transition = next(history_reader)
+    # Each new transition only updates the stats for the splits that
+    # contain it, rather than recomputing the stats for the whole route
+    split_stats = SplitStatsTracker(history, split_segments)
+    watch_segment_stats(local_segment_stats(history_reader, split_stats))
 
 if __name__ == '__main__':
   main()
@@ -13,11 +13,12 @@ if __name__ == '__main__':
   parser = argparse.ArgumentParser(description='SM Room Timer')
   parser.add_argument('--rooms', dest='rooms_filename', default='rooms.json')
   parser.add_argument('--doors', dest='doors_filename', default='doors.json')
+  parser.add_argument('--port', dest='port', type=int)
   args = parser.parse_args()
 
   rooms = Rooms.read(args.rooms_filename)
   doors = Doors.read(args.doors_filename, rooms)
-  sock = NetworkCommandSocket()
+  sock = NetworkCommandSocket(port=args.port)
 
   initial_door_ids = { key: True for key in doors.by_id.keys() }
 